@@ -6,6 +6,7 @@ A ChatGPT-like interface for the FoodFinder ReAct agent
 import streamlit as st
 import os
 import sys
+import time
 from pathlib import Path
 from dotenv import load_dotenv
 
@@ -47,6 +48,11 @@ st.set_page_config(
 st.title("🍽️ FoodFinder Chat")
 st.caption("Powered by ReAct Agent with RAG")
 
+# Streaming render throttle: redraw at most every STREAM_FLUSH_INTERVAL seconds
+# unless the response grew by more than STREAM_FLUSH_CHARS since the last redraw
+STREAM_FLUSH_INTERVAL = 0.05
+STREAM_FLUSH_CHARS = 200
+
 # Initialize the agent (cached to avoid reloading)
 @st.cache_resource
 def get_agent():
@@ -59,14 +65,47 @@ agent = get_agent()
 if "messages" not in st.session_state:
     st.session_state.messages = []
 
-# Initialize uploaded image path
+# Initialize uploaded image state. The upload is kept in memory and only
+# written to disk (once per file) when a prompt actually needs a file path.
 if "uploaded_image_path" not in st.session_state:
     st.session_state.uploaded_image_path = None
+if "uploaded_image_key" not in st.session_state:
+    st.session_state.uploaded_image_key = None
+    st.session_state.uploaded_image_bytes = None
+    st.session_state.uploaded_image_ext = None
 
 # Create temp directory for uploaded images
 temp_dir = project_root / "data" / ".temp"
 temp_dir.mkdir(parents=True, exist_ok=True)
 
+
+def cleanup_temp_uploads(max_age: int = 3600):
+    """Delete temp uploads older than max_age seconds (scans at most once per max_age)."""
+    current_time = time.time()
+    if current_time - st.session_state.get("last_cleanup", 0) <= max_age:
+        return
+    for old_file in temp_dir.glob("upload_*"):
+        if current_time - old_file.stat().st_mtime > max_age:
+            try:
+                old_file.unlink()
+            except OSError:
+                pass
+    st.session_state["last_cleanup"] = current_time
+
+
+def save_uploaded_image() -> str:
+    """Write the pending upload to the temp directory if needed and return its path."""
+    path = st.session_state.uploaded_image_path
+    if path is None or not Path(path).exists():
+        cleanup_temp_uploads()
+        timestamp = int(time.time())
+        temp_image_path = temp_dir / f"upload_{timestamp}.{st.session_state.uploaded_image_ext}"
+        temp_image_path.write_bytes(st.session_state.uploaded_image_bytes)
+        path = str(temp_image_path)
+        st.session_state.uploaded_image_path = path
+    return path
+
+
 # Image upload section (above chat)
 uploaded_file = st.file_uploader(
     "📸 Upload a food/restaurant image (optional)",
@@ -76,32 +115,21 @@ uploaded_file = st.file_uploader(
 
 # Handle image upload
 if uploaded_file is not None:
-    # Clean up old temp files (older than 1 hour)
-    import time
-    current_time = time.time()
-    for old_file in temp_dir.glob("upload_*"):
-        if current_time - old_file.stat().st_mtime > 3600:  # 1 hour
-            try:
-                old_file.unlink()
-            except:
-                pass
-    
-    # Save uploaded file to temp directory
-    timestamp = int(current_time)
-    file_extension = uploaded_file.name.split(".")[-1]
-    temp_image_path = temp_dir / f"upload_{timestamp}.{file_extension}"
-    
-    # Write the uploaded file
-    with open(temp_image_path, "wb") as f:
-        f.write(uploaded_file.getbuffer())
-    
-    # Store path in session state
-    st.session_state.uploaded_image_path = str(temp_image_path)
+    # Only pick up the bytes when a different file is uploaded, not on every rerun
+    if st.session_state.uploaded_image_key != uploaded_file.file_id:
+        st.session_state.uploaded_image_key = uploaded_file.file_id
+        st.session_state.uploaded_image_bytes = uploaded_file.getvalue()
+        st.session_state.uploaded_image_ext = uploaded_file.name.split(".")[-1]
+        st.session_state.uploaded_image_path = None
     
     # # Display the uploaded image
     # st.image(uploaded_file, caption="Uploaded Image", use_container_width=True)
     st.success(f"Image uploaded! You can now ask questions about it or search for similar restaurants.")
     st.info(f"💡 Try: 'What type of cuisine is this?' or 'Find similar restaurants'")
+else:
+    st.session_state.uploaded_image_key = None
+    st.session_state.uploaded_image_bytes = None
+    st.session_state.uploaded_image_path = None
 
 # Display chat messages from history on app rerun
 for message in st.session_state.messages:
@@ -116,11 +144,14 @@ if prompt := st.chat_input("Ask me about restaurants..."):
     # Prepare user message with optional image
     user_message = {"role": "user", "content": prompt}
     
+    # The agent's image tools take a file path, so materialize the upload now
+    image_path = save_uploaded_image() if st.session_state.uploaded_image_bytes is not None else None
+    
     # If there's an uploaded image, include it in the message
-    if st.session_state.uploaded_image_path:
-        user_message["image_path"] = st.session_state.uploaded_image_path
+    if image_path:
+        user_message["image_path"] = image_path
         # Enhance prompt with image context
-        enhanced_prompt = f"{prompt}\n\n[Image uploaded: {st.session_state.uploaded_image_path}]"
+        enhanced_prompt = f"{prompt}\n\n[Image uploaded: {image_path}]"
     else:
         enhanced_prompt = prompt
     
@@ -131,28 +162,38 @@ if prompt := st.chat_input("Ask me about restaurants..."):
     with st.chat_message("user"):
         st.markdown(prompt)
         # Display image if uploaded
-        if st.session_state.uploaded_image_path:
-            st.image(st.session_state.uploaded_image_path, width=300)
+        if image_path:
+            st.image(image_path, width=300)
     
     # Display assistant response in chat message container
     with st.chat_message("assistant"):
         # Create a placeholder for streaming
         message_placeholder = st.empty()
         full_response = ""
+        rendered = ""
+        last_flush = time.monotonic()
+        message_id = None
         
         # Stream the agent's response
         try:
-            # Use the agent's stream method to get updates (with enhanced prompt)
-            for chunk in agent.stream(enhanced_prompt):
-                # Extract the latest message from the chunk
-                if "agent" in chunk:
-                    messages = chunk["agent"]["messages"]
-                    if messages:
-                        latest_message = messages[-1]
-                        # Check if it's an AI message (not a tool call)
-                        if hasattr(latest_message, 'content') and latest_message.content:
-                            full_response = latest_message.content
-                            message_placeholder.markdown(full_response + "▌")
+            # Stream token deltas from the agent (with enhanced prompt)
+            for delta_id, delta in agent.stream_tokens(enhanced_prompt):
+                # A new agent message (next ReAct turn) replaces the previous text
+                if delta_id != message_id:
+                    message_id = delta_id
+                    full_response = ""
+                    rendered = ""
+                full_response += delta
+                
+                # Coalesce updates: each markdown() call is a websocket frame + rerender
+                now = time.monotonic()
+                if full_response != rendered and (
+                    now - last_flush >= STREAM_FLUSH_INTERVAL
+                    or len(full_response) - len(rendered) > STREAM_FLUSH_CHARS
+                ):
+                    message_placeholder.markdown(full_response + "▌")
+                    rendered = full_response
+                    last_flush = now
             
             # Display final response
             message_placeholder.markdown(full_response)
@@ -164,9 +205,6 @@ if prompt := st.chat_input("Ask me about restaurants..."):
     
     # Add assistant response to chat history
     st.session_state.messages.append({"role": "assistant", "content": full_response})
-    
-    # Clear uploaded image after processing
-    st.session_state.uploaded_image_path = None
 
 # Sidebar with info
 with st.sidebar:
@@ -1,48 +1,204 @@
+import os
 import sys
 from pathlib import Path
+from functools import partial
 sys.path.append(str(Path(__file__).parent.parent))
+# Same-shape batches reuse cached CUDA blocks; expandable segments keep fragmentation (and
+# peak memory) down without emptying the cache. Must be set before CUDA initializes.
+os.environ.setdefault("PYTORCH_CUDA_ALLOC_CONF", "expandable_segments:True")
 from dotenv import load_dotenv
 import json
+import numpy as np
+import orjson
+import pyarrow as pa
+import torch
+import xxhash
 from tqdm import tqdm
 from src.vectorstore.faiss_index import FAISSIndex
-from src.embeddings.text_embedder import TextEmbedder
+from src.embeddings.text_embedder import TextEmbedder, weights_dtype, DEFAULT_MODEL_NAME as TEXT_MODEL_NAME
 from src.embeddings.image_embedder import ImageEmbedder
-from scripts.metadata_utils import create_text_metadata, create_image_metadata
-from scripts.text_utils import create_rich_text
+from scripts.metadata_utils import create_text_metadata, create_image_metadata, clear_metadata_caches
+from scripts.text_utils import create_rich_text, rich_text_digest
+from scripts.process_data import scan_photo_ids
+
+# Above this many vectors a flat scan gets slow; switch to an IVF index
+IVF_THRESHOLD = 50_000
+
+# Image vectors are stored as float16: scans are memory-bound, and normalized CLIP
+# embeddings lose no measurable recall at half precision. Flat SQfp16 has no GPU version,
+# so GPU hosts build Flat (to_gpu stores it as float16 on the device)
+IMAGE_STORAGE = "SQfp16"
+
+def choose_index_type(num_vectors: int, index_factory: str = None, storage: str = "Flat") -> str:
+    """Pick the FAISS index type: an explicit factory string, else IVF for large corpora.
+    
+    storage is how vectors are encoded: "Flat" (float32) or e.g. "SQfp16" (float16).
+    IVF indexes of any storage go to the GPU, flat ones only as "Flat".
+    """
+    if index_factory:
+        return index_factory
+    if num_vectors > IVF_THRESHOLD:
+        return f"IVF{int(4 * np.sqrt(num_vectors))},{storage}"
+    return "Flat" if FAISSIndex.gpu_available() else storage
+
+# Batch sizes tried by probe_batch_size, smallest first
+BATCH_SIZE_CANDIDATES = (64, 128, 256, 512)
+
+def probe_batch_size(embed_batch, sample: list, default: int, max_memory_fraction: float = 0.9) -> int:
+    """Pick the largest candidate batch size that embeds a warmup slice of sample.
+    
+    Stops at the first out-of-memory error, or once the peak reserved memory
+    gets close to the GPU's capacity. CPU throughput barely depends on batch
+    size, and a sample smaller than the largest candidate fits in a few default
+    batches anyway, so in both cases the default is returned without probing.
+    """
+    if not torch.cuda.is_available() or len(sample) < BATCH_SIZE_CANDIDATES[-1]:
+        return default
+    
+    total_memory = torch.cuda.get_device_properties(0).total_memory
+    best = default
+    for batch_size in BATCH_SIZE_CANDIDATES:
+        torch.cuda.reset_peak_memory_stats()
+        try:
+            embed_batch(sample[:batch_size], batch_size=batch_size, show_progress=False)
+        except torch.cuda.OutOfMemoryError:
+            break
+        finally:
+            torch.cuda.empty_cache()
+        best = batch_size
+        if torch.cuda.max_memory_reserved() > max_memory_fraction * total_memory:
+            break
+    
+    print(f"Using batch size {best}")
+    return best
+
+# Text embeddings keyed by rich_text_digest, reused by any later build
+TEXT_EMBEDDING_CACHE = "indexes/text_embedding_cache.npz"
+
+def load_embedding_cache(cache_path: str) -> dict:
+    """Return the digest -> embedding cache saved by save_embedding_cache (empty if missing)."""
+    if not Path(cache_path).exists():
+        return {}
+    with np.load(cache_path) as cache:
+        return dict(zip(cache['digests'].tolist(), cache['embeddings']))
+
+def save_embedding_cache(cache_path: str, cache: dict):
+    Path(cache_path).parent.mkdir(parents=True, exist_ok=True)
+    if not cache:
+        Path(cache_path).unlink(missing_ok=True)
+        return
+    # Two arrays rather than one npz member per digest, which would be slow to open
+    np.savez(cache_path, digests=np.array(list(cache)), embeddings=np.vstack(list(cache.values())))
+
+def restaurant_hash(restaurant: dict) -> int:
+    """Content hash of a restaurant record (independent of key order)."""
+    return xxhash.xxh64(orjson.dumps(restaurant, option=orjson.OPT_SORT_KEYS)).intdigest()
+
+def save_hashes(name: str, hashes: dict):
+    """Persist business_id -> content hash next to indexes/{name}_index.faiss."""
+    Path(f"indexes/{name}_hashes.json").write_bytes(orjson.dumps(hashes))
+
+def load_previous_build(name: str):
+    """Return (hashes, embeddings, metadata) from the last build of an index, or None.
+    
+    Embeddings are reconstructed from the saved index, so unchanged rows can be
+    reused without running the embedding model again.
+    """
+    index_path = Path(f"indexes/{name}_index.faiss")
+    metadata_path = Path(f"indexes/{name}_metadata.parquet")
+    hashes_path = Path(f"indexes/{name}_hashes.json")
+    if not (index_path.exists() and metadata_path.exists() and hashes_path.exists()):
+        return None
+    
+    previous = FAISSIndex(dimension=0).load(str(index_path), str(metadata_path))
+    return orjson.loads(hashes_path.read_bytes()), previous.reconstruct_all(), previous.metadata_rows()
 
 def load_restaurants(data_path: str = "data/processed/restaurants.json"):
     with open(data_path, 'r', encoding='utf-8') as f:
         return json.load(f)
 
-def build_text_index(restaurants: list):
+def build_text_index(restaurants: list, index_factory: str = None, ondisk: bool = True,
+                     incremental: bool = False, batch_size: int = None):
     print("\n=== Building Text Index ===")
     
-    embedder = TextEmbedder()
-    index = FAISSIndex(dimension=768, index_type="Flat")
+    clear_metadata_caches()
+    index_type = choose_index_type(len(restaurants), index_factory)
+    index = FAISSIndex(dimension=768, index_type=index_type).to_gpu()
+    print(f"Index type: {index_type}{' (GPU)' if index.on_gpu else ''}")
     
-    texts = []
-    metadata = []
+    hashes = {r['business_id']: restaurant_hash(r) for r in restaurants}
+    previous = load_previous_build("text") if incremental else None
     
-    for restaurant in tqdm(restaurants, desc="Preparing texts"):
-        # Use rich text representation with all priority fields
-        text = create_rich_text(restaurant)
-        texts.append(text)
-        # Use comprehensive metadata from metadata_utils
-        metadata.append(create_text_metadata(restaurant))
+    # Unchanged restaurants keep their previous embedding and metadata
+    reused = {}
+    if previous:
+        prev_hashes, prev_embeddings, prev_metadata = previous
+        reused = {
+            row['id']: (prev_embeddings[i], row) for i, row in enumerate(prev_metadata)
+            if prev_hashes.get(row['id']) == hashes.get(row['id'])
+        }
+    changed = [r for r in restaurants if r['business_id'] not in reused]
+    if previous:
+        print(f"Reusing {len(reused)} unchanged restaurants, {len(changed)} new or changed")
+    
+    print("Preparing texts...")
+    # Use rich text representation with all priority fields
+    texts = [create_rich_text(restaurant) for restaurant in changed]
+    # Use comprehensive metadata from metadata_utils
+    new_metadata = [create_text_metadata(restaurant) for restaurant in changed]
     
     print("Generating text embeddings...")
-    embeddings = embedder.embed_batch(texts, batch_size=64)
+    # Texts embedded by an earlier build (any restaurant, same model and precision) come
+    # from the cache; FP16 (CUDA) and FP32 embeddings are never mixed in one index
+    dtype = weights_dtype()
+    digests = [rich_text_digest(text, TEXT_MODEL_NAME, dtype) for text in texts]
+    cache = load_embedding_cache(TEXT_EMBEDDING_CACHE)
+    missing = [i for i, digest in enumerate(digests) if digest not in cache]
+    if len(missing) < len(texts):
+        print(f"Using {len(texts) - len(missing)} cached embeddings, embedding {len(missing)} texts")
+    if missing:
+        embedder = TextEmbedder()
+        missing_texts = [texts[i] for i in missing]
+        if batch_size is None:
+            batch_size = probe_batch_size(embedder.embed_batch, missing_texts, default=64)
+        cache.update(zip([digests[i] for i in missing], embedder.embed_many(missing_texts, batch_size=batch_size)))
+    
+    # A full build sees every live text, so embeddings of texts no longer in the corpus
+    # are dropped (an incremental build only sees the changed ones and keeps the rest)
+    stale = 0
+    if not reused:
+        live = {digest: cache[digest] for digest in digests}
+        stale = len(cache) - len(live)
+        cache = live
+    if missing or stale:
+        save_embedding_cache(TEXT_EMBEDDING_CACHE, cache)
+    
+    if texts:
+        new_embeddings = np.vstack([cache[digest] for digest in digests])
+    else:
+        new_embeddings = np.empty((0, 768), dtype='float32')
+    
+    # Keep the original restaurant order
+    fresh = zip(new_embeddings, new_metadata)
+    rows = [reused.get(r['business_id']) or next(fresh) for r in restaurants]
+    embeddings = np.vstack([embedding for embedding, _ in rows])
+    metadata = [row for _, row in rows]
     
     print("Adding to index...")
     index.add(embeddings, metadata)
     
+    if ondisk:
+        index.move_invlists_to_disk("indexes/text_index.ivfdata")
+    
     print("Saving index...")
-    index.save("indexes/text_index.faiss", "indexes/text_metadata.pkl")
+    index.save("indexes/text_index.faiss", "indexes/text_metadata.parquet")
+    save_hashes("text", hashes)
     
     print(f"✓ Text index built with {len(restaurants)} restaurants")
     return index
 
-def build_image_index(restaurants: list, limit: int = None):
+def build_image_index(restaurants: list, limit: int = None, index_factory: str = None, ondisk: bool = True,
+                      incremental: bool = False, batch_size: int = None):
     print("\n=== Building Image Index ===")
     
     restaurants_with_photos = [r for r in restaurants if r.get('photos')]
@@ -52,54 +208,94 @@ def build_image_index(restaurants: list, limit: int = None):
         print("⚠️  No photos found, skipping image index")
         return None
     
-    embedder = ImageEmbedder()
-    index = FAISSIndex(dimension=512, index_type="Flat")
-    
     image_paths = []
-    metadata = []
+    # Collected column-wise: one list per field instead of one dict per photo
+    columns = {key: [] for key in (
+        'id', 'name', 'photo_id', 'label', 'categories', 'rating',
+        'latitude', 'longitude', 'address', 'city', 'state'
+    )}
+    existing_photo_ids = scan_photo_ids()
     
     for restaurant in tqdm(restaurants_with_photos, desc="Collecting images"):
         for photo in restaurant['photos']:
             photo_path = photo['path']
-            if Path(photo_path).exists():
+            if photo['photo_id'] in existing_photo_ids:
                 image_paths.append(photo_path)
-                metadata.append({
-                    'id': restaurant['business_id'],
-                    'name': restaurant['name'],
-                    'photo_id': photo['photo_id'],
-                    'label': photo.get('label', ''),
-                    'categories': restaurant.get('categories', ''),
-                    'rating': restaurant.get('stars', 0),
-                    'latitude': restaurant.get('latitude'),
-                    'longitude': restaurant.get('longitude'),
-                    'address': restaurant.get('address', ''),
-                    'city': restaurant.get('city', ''),
-                    'state': restaurant.get('state', '')
-                })
+                columns['id'].append(restaurant['business_id'])
+                columns['name'].append(restaurant['name'])
+                columns['photo_id'].append(photo['photo_id'])
+                columns['label'].append(photo.get('label', ''))
+                columns['categories'].append(restaurant.get('categories', ''))
+                columns['rating'].append(restaurant.get('stars', 0))
+                columns['latitude'].append(restaurant.get('latitude'))
+                columns['longitude'].append(restaurant.get('longitude'))
+                columns['address'].append(restaurant.get('address', ''))
+                columns['city'].append(restaurant.get('city', ''))
+                columns['state'].append(restaurant.get('state', ''))
+    
+    metadata = pa.Table.from_pydict(columns)
     
     print(f"Found {len(image_paths)} valid image files")
     
     # Apply limit if specified
     if limit and limit > 0:
         image_paths = image_paths[:limit]
-        metadata = metadata[:limit]
+        metadata = metadata.slice(0, limit)
         print(f"Limiting to {len(image_paths)} images for testing")
     
     if len(image_paths) == 0:
         print("⚠️  No valid image files found, skipping image index")
         return None
     
+    index_type = choose_index_type(len(image_paths), index_factory, storage=IMAGE_STORAGE)
+    index = FAISSIndex(dimension=512, index_type=index_type).to_gpu()
+    print(f"Index type: {index_type}{' (GPU)' if index.on_gpu else ''}")
+    
+    hashes = {r['business_id']: restaurant_hash(r) for r in restaurants_with_photos}
+    previous = load_previous_build("image") if incremental else None
+    
+    # Photos of unchanged restaurants keep their previous embedding
+    reused = {}
+    if previous:
+        prev_hashes, prev_embeddings, prev_metadata = previous
+        reused = {
+            row['photo_id']: prev_embeddings[i] for i, row in enumerate(prev_metadata)
+            if prev_hashes.get(row['id']) == hashes.get(row['id'])
+        }
+    photo_ids = metadata.column('photo_id').to_pylist()
+    to_embed = [i for i, photo_id in enumerate(photo_ids) if photo_id not in reused]
+    if previous:
+        print(f"Reusing {len(photo_ids) - len(to_embed)} unchanged photos, {len(to_embed)} new or changed")
+    
     print("Generating image embeddings (this may take a while)...")
-    embeddings, valid_indices = embedder.embed_batch(image_paths, batch_size=32, return_indices=True)
+    vectors = {i: reused[photo_id] for i, photo_id in enumerate(photo_ids) if photo_id in reused}
+    if to_embed:
+        embedder = ImageEmbedder()
+        paths = [image_paths[i] for i in to_embed]
+        if batch_size is None:
+            # Warm-up batches decode in-process rather than starting a DataLoader pool per probe
+            batch_size = probe_batch_size(partial(embedder.embed_batch, num_workers=0), paths, default=32)
+        new_embeddings, new_indices = embedder.embed_batch(paths, batch_size=batch_size, return_indices=True)
+        vectors.update((to_embed[j], embedding) for j, embedding in zip(new_indices, new_embeddings))
+    
+    valid_indices = sorted(vectors)
+    if not valid_indices:
+        print("⚠️  No images could be embedded, skipping image index")
+        return None
+    embeddings = np.vstack([vectors[i] for i in valid_indices])
     
     # Filter metadata to only include successfully embedded images
-    valid_metadata = [metadata[i] for i in valid_indices]
+    valid_metadata = metadata.take(np.asarray(valid_indices, dtype=np.int64))
     
     print("Adding to index...")
     index.add(embeddings, valid_metadata)
     
+    if ondisk:
+        index.move_invlists_to_disk("indexes/image_index.ivfdata")
+    
     print("Saving index...")
-    index.save("indexes/image_index.faiss", "indexes/image_metadata.pkl")
+    index.save("indexes/image_index.faiss", "indexes/image_metadata.parquet")
+    save_hashes("image", hashes)
     
     print(f"✓ Image index built with {len(valid_metadata)} photos ({len(image_paths) - len(valid_metadata)} skipped)")
     return index
@@ -115,8 +311,22 @@ def main():
     parser.add_argument('--sample', action='store_true', help='Use sample dataset')
     parser.add_argument('--force', action='store_true', help='Force rebuild even if indices exist')
     parser.add_argument('--limit', type=int, help='Limit number of images to process (for testing)')
+    parser.add_argument('--index-factory', type=str,
+                        help=f'FAISS index factory string (default: Flat for text and {IMAGE_STORAGE} for images on CPU-only hosts, as IVF when more than {IVF_THRESHOLD:,} vectors)')
+    parser.add_argument('--text-batch', type=int,
+                        help='Text embedding batch size (default: probe the largest that fits on the GPU, 64 on CPU)')
+    parser.add_argument('--image-batch', type=int,
+                        help='Image embedding batch size (default: probe the largest that fits on the GPU, 32 on CPU)')
+    parser.add_argument('--incremental', action='store_true',
+                        help='Rebuild existing indices, re-embedding only restaurants whose data changed')
+    parser.add_argument('--no-ondisk', action='store_true',
+                        help='Keep IVF inverted lists inside the .faiss file instead of a memory-mapped .ivfdata file')
     args = parser.parse_args()
     
+    # An incremental build always rebuilds, reusing whatever is unchanged
+    if args.incremental:
+        args.force = True
+    
     print("="*60)
     print("Building FAISS Indices")
     print("="*60)
@@ -151,10 +361,13 @@ def main():
     print(f"Loaded {len(restaurants)} restaurants")
     
     if not args.image_only and (args.force or not text_index_exists):
-        text_index = build_text_index(restaurants)
+        text_index = build_text_index(restaurants, index_factory=args.index_factory, ondisk=not args.no_ondisk,
+                                      incremental=args.incremental, batch_size=args.text_batch)
     
     if not args.text_only and (args.force or not image_index_exists):
-        image_index = build_image_index(restaurants, limit=args.limit)
+        image_index = build_image_index(restaurants, limit=args.limit, index_factory=args.index_factory,
+                                        ondisk=not args.no_ondisk, incremental=args.incremental,
+                                        batch_size=args.image_batch)
     
     print("\n" + "="*60)
     print("Index Building Complete!")
@@ -163,11 +376,11 @@ def main():
     if not args.image_only:
         status = "✓ Built" if (args.force or not text_index_exists) else "✓ Exists"
         print(f"  {status}: indexes/text_index.faiss")
-        print(f"  {status}: indexes/text_metadata.pkl")
+        print(f"  {status}: indexes/text_metadata.parquet")
     if not args.text_only:
         status = "✓ Built" if (args.force or not image_index_exists) else "✓ Exists"
         print(f"  {status}: indexes/image_index.faiss")
-        print(f"  {status}: indexes/image_metadata.pkl")
+        print(f"  {status}: indexes/image_metadata.parquet")
 
 if __name__ == "__main__":
     main()
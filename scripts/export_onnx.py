@@ -0,0 +1,46 @@
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).parent.parent))
+
+from src.utils.onnx_clip import export_vision_encoder, onnx_available, vision_model_path, ONNX_DIR
+
+DEFAULT_MODEL_NAME = "openai/clip-vit-base-patch32"
+
+def main():
+    import argparse
+    
+    parser = argparse.ArgumentParser(description='Export the CLIP vision encoder to ONNX')
+    parser.add_argument('--model', default=DEFAULT_MODEL_NAME, help='CLIP model to export')
+    parser.add_argument('--force', action='store_true', help='Re-export even if the models exist')
+    args = parser.parse_args()
+    
+    if not onnx_available():
+        print("onnxruntime is not installed: pip install onnxruntime (or onnxruntime-gpu)")
+        sys.exit(1)
+    
+    print("="*60)
+    print("Exporting CLIP Vision Encoder")
+    print("="*60)
+    
+    # fp32 serves ImageEmbedder (index and query embeddings), int8 serves ImageQATool;
+    # without an export, both run the PyTorch model
+    for quantized in (False, True):
+        onnx_path = vision_model_path(args.model, quantized=quantized)
+        if args.force:
+            onnx_path.unlink(missing_ok=True)
+        if onnx_path.exists():
+            print(f"Exists: {onnx_path}")
+            continue
+        try:
+            export_vision_encoder(args.model, quantized=quantized)
+        except Exception as e:
+            print(f"✗ Export failed ({e}); the PyTorch encoder will be used")
+            sys.exit(1)
+        print(f"Exported: {onnx_path}")
+    
+    print("\n" + "="*60)
+    print(f"✓ ONNX models in {ONNX_DIR}")
+    print("="*60)
+
+if __name__ == "__main__":
+    main()
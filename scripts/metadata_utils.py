@@ -1,76 +1,114 @@
+import ast
 import json
+import sys
+from functools import lru_cache
 
-def extract_attributes(restaurant: dict) -> dict:
-    """Extract and normalize restaurant attributes."""
-    attrs = restaurant.get('attributes') or {}
-    
-    # Helper to parse string booleans
-    def parse_bool(value):
-        if value is None:
-            return None
-        if isinstance(value, bool):
-            return value
-        if isinstance(value, str):
-            value_lower = value.lower().strip("'\"u ")
-            if value_lower in ('true', '1'):
-                return True
-            if value_lower in ('false', '0', 'none'):
-                return False
+import orjson
+
+# Quote/unicode-prefix characters wrapped around Yelp attribute strings ("u'free'")
+_STRIP = "'\"u "
+_TRUE = frozenset({'true', '1'})
+_FALSE = frozenset({'false', '0', 'none'})
+
+def _parse_bool(value):
+    """Parse string booleans."""
+    if value is None or isinstance(value, bool):
+        return value
+    if isinstance(value, str):
+        value = value.lower().strip(_STRIP)
+        return True if value in _TRUE else False if value in _FALSE else None
+    return None
+
+def _parse_price(value):
+    if value is None:
         return None
-    
-    # Helper to parse price range
-    def parse_price(value):
-        if value is None:
-            return None
-        try:
-            return int(value)
-        except:
-            return None
-    
-    # Helper to parse parking (often a JSON string)
-    def parse_parking(value):
-        if value is None:
-            return None
-        if isinstance(value, dict):
-            return value
-        if isinstance(value, str):
-            try:
-                # Remove u' prefix if present
-                value = value.replace("u'", "'")
-                return eval(value)  # Safe here since it's from trusted dataset
-            except:
-                return None
+    try:
+        return int(value)
+    except (ValueError, TypeError):
         return None
-    
-    # Helper to clean string values
-    def clean_string(value):
-        if value is None:
-            return None
-        if isinstance(value, str):
-            return value.strip("'\"u ")
+
+def _parse_parking(value):
+    """Parse parking (often a dict literal stored as a string)."""
+    if value is None:
+        return None
+    if isinstance(value, dict):
         return value
+    if isinstance(value, str):
+        try:
+            # Remove u' prefix if present
+            value = value.replace("u'", "'")
+            # literal_eval only accepts literals: faster than eval and can't run code
+            return ast.literal_eval(value)
+        except (ValueError, SyntaxError, TypeError):
+            return None
+    return None
+
+def _clean_string(value):
+    """Strip quoting from string values (few distinct values, so intern them)."""
+    if isinstance(value, str):
+        return sys.intern(value.strip(_STRIP))
+    return value
+
+def extract_attributes(restaurant: dict) -> dict:
+    """Extract and normalize restaurant attributes."""
+    attrs = restaurant.get('attributes') or {}
     
     return {
-        'price_range': parse_price(attrs.get('RestaurantsPriceRange2')),
-        'takes_reservations': parse_bool(attrs.get('RestaurantsReservations')),
-        'delivery': parse_bool(attrs.get('RestaurantsDelivery')),
-        'takeout': parse_bool(attrs.get('RestaurantsTakeOut')),
-        'outdoor_seating': parse_bool(attrs.get('OutdoorSeating')),
-        'good_for_kids': parse_bool(attrs.get('GoodForKids')),
-        'wifi': clean_string(attrs.get('WiFi')),
-        'alcohol': clean_string(attrs.get('Alcohol')),
-        'parking': parse_parking(attrs.get('BusinessParking')),
-        'wheelchair_accessible': parse_bool(attrs.get('WheelchairAccessible')),
-        'caters': parse_bool(attrs.get('Caters')),
-        'has_tv': parse_bool(attrs.get('HasTV')),
-        'noise_level': clean_string(attrs.get('NoiseLevel')),
-        'attire': clean_string(attrs.get('RestaurantsAttire')),
-        'good_for_groups': parse_bool(attrs.get('RestaurantsGoodForGroups')),
+        'price_range': _parse_price(attrs.get('RestaurantsPriceRange2')),
+        'takes_reservations': _parse_bool(attrs.get('RestaurantsReservations')),
+        'delivery': _parse_bool(attrs.get('RestaurantsDelivery')),
+        'takeout': _parse_bool(attrs.get('RestaurantsTakeOut')),
+        'outdoor_seating': _parse_bool(attrs.get('OutdoorSeating')),
+        'good_for_kids': _parse_bool(attrs.get('GoodForKids')),
+        'wifi': _clean_string(attrs.get('WiFi')),
+        'alcohol': _clean_string(attrs.get('Alcohol')),
+        'parking': _parse_parking(attrs.get('BusinessParking')),
+        'wheelchair_accessible': _parse_bool(attrs.get('WheelchairAccessible')),
+        'caters': _parse_bool(attrs.get('Caters')),
+        'has_tv': _parse_bool(attrs.get('HasTV')),
+        'noise_level': _clean_string(attrs.get('NoiseLevel')),
+        'attire': _clean_string(attrs.get('RestaurantsAttire')),
+        'good_for_groups': _parse_bool(attrs.get('RestaurantsGoodForGroups')),
     }
 
+# Identical opening-hours dicts (chains, common schedules) share one object
+_HOURS_CACHE = {}
+
+def _intern_hours(hours):
+    """Return a shared dict equal to hours, so duplicates aren't kept or pickled twice."""
+    if not isinstance(hours, dict):
+        return hours
+    key = tuple(sorted(hours.items()))
+    return _HOURS_CACHE.setdefault(key, hours)
+
+def _intern_str(value):
+    return sys.intern(value) if isinstance(value, str) else value
+
+# extract_attributes results keyed by the raw attributes payload, so a restaurant is parsed
+# once even though its metadata is built for every photo, and an edited record is re-parsed
+@lru_cache(maxsize=65536)
+def _parse_attributes(payload: bytes) -> dict:
+    return extract_attributes({'attributes': orjson.loads(payload)})
+
+def _extract_attributes_cached(restaurant: dict) -> dict:
+    """extract_attributes memoized on the attributes payload (the result is shared, don't mutate it)."""
+    attrs = restaurant.get('attributes')
+    if not attrs:
+        return extract_attributes(restaurant)
+    try:
+        payload = orjson.dumps(attrs, option=orjson.OPT_SORT_KEYS)
+    except TypeError:
+        return extract_attributes(restaurant)
+    return _parse_attributes(payload)
+
+def clear_metadata_caches():
+    """Drop memoized attributes and shared hours; call at the start of each build."""
+    _parse_attributes.cache_clear()
+    _HOURS_CACHE.clear()
+
 def create_text_metadata(restaurant: dict) -> dict:
     """Create comprehensive metadata for text index."""
-    attrs = extract_attributes(restaurant)
+    attrs = _extract_attributes_cached(restaurant)
     
     return {
         # Core
@@ -85,20 +123,20 @@ def create_text_metadata(restaurant: dict) -> dict:
         'latitude': restaurant.get('latitude'),
         'longitude': restaurant.get('longitude'),
         'address': restaurant.get('address', ''),
-        'city': restaurant.get('city', ''),
-        'state': restaurant.get('state', ''),
+        'city': _intern_str(restaurant.get('city', '')),
+        'state': _intern_str(restaurant.get('state', '')),
         'postal_code': restaurant.get('postal_code', ''),
         
         # Attributes
         **attrs,
         
         # Hours
-        'hours': restaurant.get('hours', {})
+        'hours': _intern_hours(restaurant.get('hours', {}))
     }
 
 def create_image_metadata(restaurant: dict, photo: dict) -> dict:
     """Create metadata for image index (no location data - use text search for location filtering)."""
-    attrs = extract_attributes(restaurant)
+    attrs = _extract_attributes_cached(restaurant)
     
     return {
         # Core
@@ -115,5 +153,5 @@ def create_image_metadata(restaurant: dict, photo: dict) -> dict:
         **attrs,
         
         # Hours
-        'hours': restaurant.get('hours', {})
+        'hours': _intern_hours(restaurant.get('hours', {}))
     }
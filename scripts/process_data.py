@@ -2,58 +2,78 @@ import sys
 from pathlib import Path
 sys.path.append(str(Path(__file__).parent.parent))
 
+import os
 import json
-from tqdm import tqdm
+import re
+import orjson
+from functools import partial
 from collections import defaultdict
+from typing import Iterable
+from scripts.text_utils import throttled_tqdm
+
+# Throttled progress bars (see text_utils); --quiet disables them
+_TQDM = throttled_tqdm
+
+# Any of these in a business's categories marks it as a restaurant
+RESTAURANT_KEYWORDS = [
+    'restaurant', 'food', 'cafe', 'bar', 'pizza', 'burger',
+    'sushi', 'mexican', 'italian', 'chinese', 'japanese',
+    'thai', 'indian', 'korean', 'vietnamese', 'american',
+    'breakfast', 'brunch', 'lunch', 'dinner', 'bakery',
+    'coffee', 'tea', 'sandwiches', 'deli', 'grill'
+]
+# Single alternation so each business is matched in one C-level scan
+_RESTAURANT_RE = re.compile("|".join(map(re.escape, RESTAURANT_KEYWORDS)), re.IGNORECASE)
+
+PHOTOS_DIR = "data/raw/photos"
+
+def scan_photo_ids(photos_dir: str = PHOTOS_DIR) -> set:
+    """Return IDs of photos with a .jpg in photos_dir using one directory scan.
+    
+    Checking membership in this set replaces a stat() syscall per photo.
+    """
+    if not Path(photos_dir).is_dir():
+        return set()
+    with os.scandir(photos_dir) as entries:
+        return {entry.name[:-4] for entry in entries if entry.name.endswith('.jpg') and entry.is_file()}
 
 def load_businesses(raw_path: str = "data/raw/yelp_academic_dataset_business.json"):
-    businesses = []
-    with open(raw_path, 'r', encoding='utf-8') as f:
-        for line in tqdm(f, desc="Loading businesses"):
-            businesses.append(json.loads(line))
-    return businesses
+    """Yield businesses one at a time so the raw dataset is never held in memory."""
+    with open(raw_path, 'rb') as f:
+        for line in _TQDM(f, desc="Loading businesses"):
+            yield orjson.loads(line)
 
 def load_photos(raw_path: str = "data/raw/photos.json"):
-    photos = []
+    """Yield photo records one at a time (nothing if the photos file is missing)."""
     if not Path(raw_path).exists():
         print(f"⚠️  Photos file not found: {raw_path}")
-        return photos
+        return
     
-    with open(raw_path, 'r', encoding='utf-8') as f:
-        for line in tqdm(f, desc="Loading photos"):
-            photos.append(json.loads(line))
-    return photos
+    with open(raw_path, 'rb') as f:
+        for line in _TQDM(f, desc="Loading photos"):
+            yield orjson.loads(line)
 
-def filter_restaurants(businesses: list):
-    restaurant_keywords = [
-        'restaurant', 'food', 'cafe', 'bar', 'pizza', 'burger',
-        'sushi', 'mexican', 'italian', 'chinese', 'japanese',
-        'thai', 'indian', 'korean', 'vietnamese', 'american',
-        'breakfast', 'brunch', 'lunch', 'dinner', 'bakery',
-        'coffee', 'tea', 'sandwiches', 'deli', 'grill'
-    ]
-    
+def filter_restaurants(businesses: Iterable[dict]):
     restaurants = []
-    for business in tqdm(businesses, desc="Filtering restaurants"):
+    for business in _TQDM(businesses, desc="Filtering restaurants"):
         categories = business.get('categories', '')
         if not categories:
             continue
         
-        categories_lower = categories.lower()
-        if any(keyword in categories_lower for keyword in restaurant_keywords):
-            if business.get('is_open', 0) == 1:
-                restaurants.append(business)
+        if _RESTAURANT_RE.search(categories) and business.get('is_open', 0) == 1:
+            restaurants.append(business)
     
     return restaurants
 
-def create_photo_mapping(photos: list):
+def create_photo_mapping(photos: Iterable[dict]):
     business_photos = defaultdict(list)
+    existing_photo_ids = scan_photo_ids()
     
-    for photo in tqdm(photos, desc="Mapping photos"):
+    for photo in _TQDM(photos, desc="Mapping photos"):
         business_id = photo['business_id']
-        photo_path = f"data/raw/photos/{photo['photo_id']}.jpg"
+        photo_path = f"{PHOTOS_DIR}/{photo['photo_id']}.jpg"
         
-        if Path(photo_path).exists():
+        if photo['photo_id'] in existing_photo_ids:
             business_photos[business_id].append({
                 'photo_id': photo['photo_id'],
                 'path': photo_path,
@@ -66,7 +86,7 @@ def create_photo_mapping(photos: list):
 def process_restaurants(restaurants: list, business_photos: dict):
     processed = []
     
-    for restaurant in tqdm(restaurants, desc="Processing restaurants"):
+    for restaurant in _TQDM(restaurants, desc="Processing restaurants"):
         processed_restaurant = {
             'business_id': restaurant['business_id'],
             'name': restaurant['name'],
@@ -108,37 +128,36 @@ def main():
     
     parser = argparse.ArgumentParser(description='Process Yelp dataset')
     parser.add_argument('--sample', type=int, help='Create sample dataset with N restaurants')
+    parser.add_argument('--quiet', action='store_true', help='Disable progress bars')
     args = parser.parse_args()
     
+    if args.quiet:
+        global _TQDM
+        _TQDM = partial(_TQDM, disable=True)
+    
     print("="*60)
     print("Yelp Dataset Processing")
     print("="*60 + "\n")
     
-    print("Step 1: Loading raw data...")
-    businesses = load_businesses()
-    photos = load_photos()
-    
-    print(f"\nLoaded:")
-    print(f"  - Businesses: {len(businesses):,}")
-    print(f"  - Photos: {len(photos):,}")
-    
-    print("\nStep 2: Filtering restaurants...")
-    restaurants = filter_restaurants(businesses)
+    # Loading is streamed straight into filtering/mapping, so the raw
+    # records are never materialized as a full list
+    print("Step 1: Loading businesses and filtering restaurants...")
+    restaurants = filter_restaurants(load_businesses())
     print(f"  - Restaurants: {len(restaurants):,}")
     
-    print("\nStep 3: Mapping photos to businesses...")
-    business_photos = create_photo_mapping(photos)
+    print("\nStep 2: Loading photos and mapping them to businesses...")
+    business_photos = create_photo_mapping(load_photos())
     restaurants_with_photos = sum(1 for r in restaurants if r['business_id'] in business_photos)
     print(f"  - Restaurants with photos: {restaurants_with_photos:,}")
     
-    print("\nStep 4: Processing restaurant data...")
+    print("\nStep 3: Processing restaurant data...")
     processed_restaurants = process_restaurants(restaurants, business_photos)
     
-    print("\nStep 5: Saving processed data...")
+    print("\nStep 4: Saving processed data...")
     save_processed_data(processed_restaurants)
     
     if args.sample:
-        print(f"\nStep 6: Creating sample dataset ({args.sample} restaurants)...")
+        print(f"\nStep 5: Creating sample dataset ({args.sample} restaurants)...")
         create_sample_dataset(processed_restaurants, args.sample)
     
     print("\n" + "="*60)
@@ -2,61 +2,74 @@ import sys
 from pathlib import Path
 sys.path.append(str(Path(__file__).parent.parent))
 
+import os
 import json
-import pickle
-from tqdm import tqdm
-from metadata_utils import create_text_metadata, create_image_metadata
+import orjson
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from metadata_utils import create_text_metadata, create_image_metadata, clear_metadata_caches
+from process_data import scan_photo_ids
+from text_utils import throttled_tqdm
+from src.vectorstore.metadata_store import save_metadata, load_metadata
 
-def rebuild_text_metadata():
-    """Rebuild text metadata pickle file without regenerating embeddings."""
-    print("\n=== Rebuilding Text Metadata ===")
-    
-    # Load processed restaurants
-    with open("data/processed/restaurants.json", 'r', encoding='utf-8') as f:
-        restaurants = json.load(f)
-    
+# Throttled progress bars (see text_utils); --quiet disables them
+_TQDM = throttled_tqdm
+
+def load_restaurants(data_path: str = "data/processed/restaurants.json") -> list:
+    """Parse the processed restaurants once; both rebuild steps share the result."""
+    restaurants = orjson.loads(Path(data_path).read_bytes())
     print(f"Loaded {len(restaurants)} restaurants")
+    return restaurants
+
+def rebuild_text_metadata(restaurants: list):
+    """Rebuild text metadata file without regenerating embeddings."""
+    print("\n=== Rebuilding Text Metadata ===")
     
-    # Create metadata
-    metadata = []
-    for restaurant in tqdm(restaurants, desc="Creating metadata"):
-        metadata.append(create_text_metadata(restaurant))
+    clear_metadata_caches()
+    # Create metadata (pure-Python parsing per record, so fan out across processes)
+    with ProcessPoolExecutor(max_workers=os.cpu_count()) as ex:
+        metadata = list(_TQDM(
+            ex.map(create_text_metadata, restaurants, chunksize=512),
+            total=len(restaurants),
+            desc="Creating metadata"
+        ))
     
     # Save metadata
-    output_path = "indexes/text_metadata.pkl"
-    Path(output_path).parent.mkdir(parents=True, exist_ok=True)
-    
-    with open(output_path, 'wb') as f:
-        pickle.dump(metadata, f)
+    output_path = "indexes/text_metadata.parquet"
+    save_metadata(metadata, output_path)
     
     print(f"✓ Saved {len(metadata)} metadata entries to {output_path}")
     return metadata
 
-def rebuild_image_metadata():
-    """Rebuild image metadata pickle file without regenerating embeddings."""
+def rebuild_image_metadata(restaurants: list):
+    """Rebuild image metadata file without regenerating embeddings."""
     print("\n=== Rebuilding Image Metadata ===")
     
-    # Load processed restaurants
-    with open("data/processed/restaurants.json", 'r', encoding='utf-8') as f:
-        restaurants = json.load(f)
-    
+    clear_metadata_caches()
     restaurants_with_photos = [r for r in restaurants if r.get('photos')]
     print(f"Found {len(restaurants_with_photos)} restaurants with photos")
     
-    # Create metadata
-    metadata = []
-    for restaurant in tqdm(restaurants_with_photos, desc="Creating metadata"):
+    # Flatten to one (restaurant, photo) pair per existing photo file
+    existing_photo_ids = scan_photo_ids()
+    photo_restaurants = []
+    photos = []
+    for restaurant in restaurants_with_photos:
         for photo in restaurant['photos']:
-            photo_path = photo['path']
-            if Path(photo_path).exists():
-                metadata.append(create_image_metadata(restaurant, photo))
+            if photo['photo_id'] in existing_photo_ids:
+                photo_restaurants.append(restaurant)
+                photos.append(photo)
     
-    # Save metadata
-    output_path = "indexes/image_metadata.pkl"
-    Path(output_path).parent.mkdir(parents=True, exist_ok=True)
+    # Create metadata
+    with ProcessPoolExecutor(max_workers=os.cpu_count()) as ex:
+        metadata = list(_TQDM(
+            ex.map(create_image_metadata, photo_restaurants, photos, chunksize=512),
+            total=len(photos),
+            desc="Creating metadata"
+        ))
     
-    with open(output_path, 'wb') as f:
-        pickle.dump(metadata, f)
+    # Save metadata
+    output_path = "indexes/image_metadata.parquet"
+    save_metadata(metadata, output_path)
     
     print(f"✓ Saved {len(metadata)} metadata entries to {output_path}")
     return metadata
@@ -65,8 +78,7 @@ def verify_metadata(metadata_path: str):
     """Verify metadata structure."""
     print(f"\n=== Verifying {metadata_path} ===")
     
-    with open(metadata_path, 'rb') as f:
-        metadata = pickle.load(f)
+    metadata = load_metadata(metadata_path)
     
     print(f"Total entries: {len(metadata)}")
     print(f"\nSample entry:")
@@ -79,30 +91,37 @@ def verify_metadata(metadata_path: str):
 def main():
     import argparse
     
-    parser = argparse.ArgumentParser(description='Rebuild metadata pickle files')
+    parser = argparse.ArgumentParser(description='Rebuild metadata files')
     parser.add_argument('--text-only', action='store_true', help='Rebuild only text metadata')
     parser.add_argument('--image-only', action='store_true', help='Rebuild only image metadata')
     parser.add_argument('--verify', action='store_true', help='Verify metadata after rebuilding')
+    parser.add_argument('--quiet', action='store_true', help='Disable progress bars')
     args = parser.parse_args()
     
+    if args.quiet:
+        global _TQDM
+        _TQDM = partial(_TQDM, disable=True)
+    
     print("="*60)
     print("Rebuilding Metadata Files")
     print("="*60)
     
+    restaurants = load_restaurants()
+    
     if not args.image_only:
-        text_metadata = rebuild_text_metadata()
+        text_metadata = rebuild_text_metadata(restaurants)
         if args.verify:
-            verify_metadata("indexes/text_metadata.pkl")
+            verify_metadata("indexes/text_metadata.parquet")
     
     if not args.text_only:
-        image_metadata = rebuild_image_metadata()
+        image_metadata = rebuild_image_metadata(restaurants)
         if args.verify:
-            verify_metadata("indexes/image_metadata.pkl")
+            verify_metadata("indexes/image_metadata.parquet")
     
     print("\n" + "="*60)
     print("Metadata Rebuild Complete!")
     print("="*60)
-    print("\nNote: This only updates metadata (.pkl files)")
+    print("\nNote: This only updates metadata (.parquet files)")
     print("The FAISS index files (.faiss) are unchanged")
 
 if __name__ == "__main__":
@@ -2,6 +2,17 @@
 Utility functions for creating rich text representations of restaurants
 """
 
+import hashlib
+from functools import partial
+from tqdm import tqdm
+
+# Progress bar for the data scripts' record loops. Redraws at most once a second: the loops
+# are fast, and a redraw every few iterations costs a noticeable share of the runtime.
+throttled_tqdm = partial(tqdm, mininterval=1.0, miniters=5000)
+
+# Attribute values that mean "yes" (Yelp stores most flags as the string 'True')
+_TRUTHY = frozenset({'True', True})
+
 def create_rich_text(restaurant: dict) -> str:
     """
     Create comprehensive text representation for better semantic search
@@ -51,15 +62,15 @@ def create_rich_text(restaurant: dict) -> str:
     # 6. Key Features (medium priority)
     features = []
     
-    if attributes.get('OutdoorSeating') == 'True' or attributes.get('OutdoorSeating') is True:
+    if attributes.get('OutdoorSeating') in _TRUTHY:
         features.append("outdoor seating")
-    if attributes.get('GoodForKids') == 'True' or attributes.get('GoodForKids') is True:
+    if attributes.get('GoodForKids') in _TRUTHY:
         features.append("kid-friendly")
-    if attributes.get('RestaurantsReservations') == 'True' or attributes.get('RestaurantsReservations') is True:
+    if attributes.get('RestaurantsReservations') in _TRUTHY:
         features.append("accepts reservations")
-    if attributes.get('RestaurantsDelivery') == 'True' or attributes.get('RestaurantsDelivery') is True:
+    if attributes.get('RestaurantsDelivery') in _TRUTHY:
         features.append("delivery available")
-    if attributes.get('RestaurantsTakeOut') == 'True' or attributes.get('RestaurantsTakeOut') is True:
+    if attributes.get('RestaurantsTakeOut') in _TRUTHY:
         features.append("takeout available")
     if attributes.get('WiFi') and attributes['WiFi'] != 'no':
         features.append("has WiFi")
@@ -76,7 +87,7 @@ def create_rich_text(restaurant: dict) -> str:
     # 7. Good For (meal types) - medium priority
     good_for = attributes.get('GoodForMeal', {})
     if isinstance(good_for, dict):
-        meals = [k.lower() for k, v in good_for.items() if v == 'True' or v is True]
+        meals = [k.lower() for k, v in good_for.items() if v in _TRUTHY]
         if meals:
             parts.append(f"Good for: {', '.join(meals)}")
     elif isinstance(good_for, str):
@@ -91,7 +102,7 @@ def create_rich_text(restaurant: dict) -> str:
     # 8. Ambiance - medium priority
     ambience = attributes.get('Ambience', {})
     if isinstance(ambience, dict):
-        ambience_types = [k.lower() for k, v in ambience.items() if v == 'True' or v is True]
+        ambience_types = [k.lower() for k, v in ambience.items() if v in _TRUTHY]
         if ambience_types:
             parts.append(f"Ambiance: {', '.join(ambience_types)}")
     
@@ -109,3 +120,8 @@ def get_price_text(restaurant: dict) -> str:
         except (ValueError, TypeError):
             return 'Unknown'
     return 'Unknown'
+
+
+def rich_text_digest(text: str, model_name: str, dtype: str) -> str:
+    """Cache key for the embedding of a rich text under a given model and weight precision"""
+    return hashlib.blake2b(f"{model_name}\0{dtype}\0{text}".encode(), digest_size=16).hexdigest()
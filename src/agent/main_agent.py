@@ -1,5 +1,6 @@
-from typing import Annotated, Literal
+from typing import Annotated
 from typing_extensions import TypedDict
+import functools
 import os
 from pathlib import Path
 from dotenv import load_dotenv
@@ -30,8 +31,31 @@ _index_dir = _project_root / "indexes"
 # Create retriever instance with absolute path
 retriever = MultimodalRetriever(index_dir=str(_index_dir))
 
-# Flag to track if indices are loaded
-_indices_loaded = False
+
+@functools.lru_cache(maxsize=8)
+def _build_agent_core(model_name: str, temperature: float):
+    """Chat model, toolkit, tools and tool-bound model for one LLM configuration
+    
+    Shared by every FoodFinderAgent with the same settings: binding tools converts
+    each tool schema to the provider's format, which a server creating one agent
+    per request would otherwise redo every time.
+    """
+    model = init_chat_model(model_name, temperature=temperature)
+    
+    # Create toolkit with retriever and LLM
+    toolkit = CustomToolkit(retriever=retriever, llm=model)
+    
+    # Get all tools from toolkit
+    tools = toolkit.get_tools()
+    
+    # Bind tools to model for ReAct loop; let OpenAI models emit several tool calls
+    # per turn, which ToolNode then runs concurrently
+    if "openai" in getattr(model, "_llm_type", ""):
+        model_with_tools = model.bind_tools(tools, parallel_tool_calls=True)
+    else:
+        model_with_tools = model.bind_tools(tools)
+    
+    return model, toolkit, tools, model_with_tools
 
 
 class FoodFinderAgent:
@@ -44,6 +68,9 @@ class FoodFinderAgent:
     4. Repeats until it can answer the user's question
     """
     
+    # Compiled graphs per (agent class, bound model, tools); see build_graph
+    _graph_cache: dict = {}
+    
     def __init__(self, model_name: str = "gpt-4o-mini", temperature: float = 0):
         """Initialize the FoodFinder ReAct agent
         
@@ -51,16 +78,11 @@ class FoodFinderAgent:
             model_name: Name of the LLM model to use
             temperature: Temperature for LLM generation
         """
-        self.model = init_chat_model(model_name, temperature=temperature)
-        
-        # Create toolkit with retriever and LLM
-        self.toolkit = CustomToolkit(retriever=retriever, llm=self.model)
-        
-        # Get all tools from toolkit
-        self.tools = self.toolkit.get_tools()
+        self.model_name = model_name
+        self.temperature = temperature
         
-        # Bind tools to model for ReAct loop
-        self.model_with_tools = self.model.bind_tools(self.tools)
+        # Model, tools and their bindings are built once per configuration
+        self.model, self.toolkit, self.tools, self.model_with_tools = _build_agent_core(model_name, temperature)
         
         self.graph = None
         
@@ -71,6 +93,7 @@ You have access to the following tools:
 - rag_text_search: Search for restaurants using text queries (cuisine, location, ratings, etc.)
 - rag_image_search: Find similar restaurants based on food/restaurant images
 - image_qa: Answer questions about specific images (cuisine type, dish description, etc.)
+- image_qa_batch: Answer the same question about several images in one call
 
 Follow the ReAct (Reasoning + Acting) pattern:
 1. REASON about what information you need to answer the user's question
@@ -86,13 +109,14 @@ When the user uploads an image and asks to find restaurants:
 3. If the JSON results lack complete information (missing details like full address, hours, reviews, etc.):
    - Extract the restaurant names from the image search results
    - Use `rag_text_search` with those restaurant names to get complete details
+     (issue one `rag_text_search` call per name in the same step - they run in parallel)
    - Combine both results for a comprehensive answer
 
 Example workflow:
 - User uploads pizza image and asks "Find similar restaurants"
 - Step 1: Call rag_image_search(image_path, k=5) → Get 5 similar restaurants with names
 - Step 2: Observe results - if they only have basic info (name, cuisine, rating)
-- Step 3: Call rag_text_search("Restaurant Name 1") to get full details
+- Step 3: Call rag_text_search("Restaurant Name 1"), rag_text_search("Restaurant Name 2"), ... in one step to get full details
 - Step 4: Combine visual similarity scores with detailed information
 - Step 5: Provide comprehensive recommendation
 
@@ -100,34 +124,38 @@ When you have enough information, provide a comprehensive and enthusiastic recom
 The tool results are in JSON format - parse them to extract relevant details like name, cuisine, rating, location, etc.
 
 Be conversational and helpful!"""
+        
+        # Sent once at the start of each conversation; every ReAct turn then shares the
+        # same prompt prefix, which providers can serve from their prompt cache
+        self.system_message = self._cacheable_system_message(self.system_prompt)
     
-    def _should_continue(self, state: MessagesState) -> Literal["tools", "end"]:
-        """Determine whether to continue with tool calls or end
+    def _cacheable_system_message(self, prompt: str) -> SystemMessage:
+        """System message, marked for prompt caching where the provider needs it
         
-        This is the ReAct decision point - does the agent need more information?
+        OpenAI caches repeated prefixes automatically; Anthropic only caches blocks
+        tagged with cache_control.
         """
-        messages = state["messages"]
-        last_message = messages[-1]
-        
-        # If the LLM makes tool calls, continue to tools node
-        if hasattr(last_message, 'tool_calls') and last_message.tool_calls:
-            return "tools"
-        # Otherwise, end the loop
-        return "end"
+        if "anthropic" in getattr(self.model, "_llm_type", ""):
+            return SystemMessage(content=[
+                {"type": "text", "text": prompt, "cache_control": {"type": "ephemeral"}}
+            ])
+        return SystemMessage(content=prompt)
+    
+    def _initial_state(self, query: str) -> dict:
+        """Initial graph state: the system prompt followed by the user's query"""
+        return {
+            "messages": [self.system_message, HumanMessage(content=query)]
+        }
     
-    def _call_model(self, state: MessagesState):
+    @staticmethod
+    def _call_model(model_with_tools, state: MessagesState):
         """Call the model with tools bound (ReAct reasoning step)
         
         This is where the agent REASONS about what to do next
         """
-        messages = state["messages"]
-        
-        # Add system prompt if this is the first call
-        if len(messages) == 1 or not any(isinstance(m, SystemMessage) for m in messages):
-            messages = [SystemMessage(content=self.system_prompt)] + messages
-        
+        # The system prompt is already the first message (see _initial_state)
         # Invoke model with tools - it will decide whether to call tools or respond
-        response = self.model_with_tools.invoke(messages)
+        response = model_with_tools.invoke(state["messages"])
         
         return {"messages": [response]}
     
@@ -142,12 +170,20 @@ Be conversational and helpful!"""
         Returns:
             Compiled StateGraph ready for execution
         """
+        # Agents of one class with the same bound model and tools (see _build_agent_core)
+        # share a compiled graph. Its nodes hold those objects, not the agent, so the
+        # ids stay valid while cached and no agent instance is kept alive.
+        cache_key = (type(self), id(self.model_with_tools), tuple(id(tool) for tool in self.tools))
+        if cache_key in self._graph_cache:
+            self.graph = self._graph_cache[cache_key]
+            return self.graph
+        
         # Initialize graph with MessagesState
         workflow = StateGraph(MessagesState)
         
         # Add nodes
         # Agent node: reasoning step (decides what to do)
-        workflow.add_node("agent", self._call_model)
+        workflow.add_node("agent", functools.partial(type(self)._call_model, self.model_with_tools))
         
         # Tools node: acting step (executes tool calls)
         workflow.add_node("tools", ToolNode(self.tools))
@@ -156,13 +192,14 @@ Be conversational and helpful!"""
         workflow.add_edge(START, "agent")
         
         # Add conditional edge from agent
-        # After reasoning, either call tools or end
+        # After reasoning, either call tools or end (tools_condition checks the last
+        # message for tool calls)
         workflow.add_conditional_edges(
             "agent",
-            self._should_continue,
+            tools_condition,
             {
                 "tools": "tools",  # Continue to tools if agent wants to act
-                "end": END,        # End if agent has final answer
+                END: END,          # End if agent has final answer
             },
         )
         
@@ -172,6 +209,7 @@ Be conversational and helpful!"""
         
         # Compile the graph
         self.graph = workflow.compile()
+        self._graph_cache[cache_key] = self.graph
         return self.graph
     
     def run(self, query: str) -> dict:
@@ -187,9 +225,7 @@ Be conversational and helpful!"""
             self.build_graph()
         
         # Create initial state
-        initial_state = {
-            "messages": [HumanMessage(content=query)]
-        }
+        initial_state = self._initial_state(query)
         
         # Run the graph - agent will loop through ReAct cycles
         result = self.graph.invoke(initial_state)
@@ -202,6 +238,30 @@ Be conversational and helpful!"""
             "messages": result["messages"]
         }
     
+    async def arun(self, query: str) -> dict:
+        """Async version of run()
+        
+        Tool calls made in the same turn are awaited concurrently.
+        
+        Args:
+            query: User's restaurant search query
+            
+        Returns:
+            Dictionary containing the response and metadata
+        """
+        if self.graph is None:
+            self.build_graph()
+        
+        result = await self.graph.ainvoke(self._initial_state(query))
+        
+        # Extract final answer
+        final_message = result["messages"][-1]
+        
+        return {
+            "answer": final_message.content,
+            "messages": result["messages"]
+        }
+    
     def stream(self, query: str):
         """Stream the ReAct agent execution
         
@@ -214,9 +274,33 @@ Be conversational and helpful!"""
         if self.graph is None:
             self.build_graph()
         
-        initial_state = {
-            "messages": [HumanMessage(content=query)]
-        }
+        initial_state = self._initial_state(query)
         
         for chunk in self.graph.stream(initial_state):
             yield chunk
+    
+    def stream_tokens(self, query: str):
+        """Stream the agent's replies token by token
+        
+        Args:
+            query: User's restaurant search query
+            
+        Yields:
+            (message_id, delta) tuples of new text from the agent node. A new
+            message_id starts a new reasoning turn, which supersedes the previous one.
+        """
+        if self.graph is None:
+            self.build_graph()
+        
+        initial_state = self._initial_state(query)
+        
+        for message, metadata in self.graph.stream(initial_state, stream_mode="messages"):
+            # Skip tool outputs; only the LLM's own text is shown to the user
+            if metadata.get("langgraph_node") != "agent":
+                continue
+            delta = message.content
+            if isinstance(delta, list):
+                # Content blocks (e.g. Anthropic): keep the text parts
+                delta = "".join(block.get("text", "") for block in delta if isinstance(block, dict))
+            if delta:
+                yield message.id, delta
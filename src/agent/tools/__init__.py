@@ -5,12 +5,13 @@ Provides specialized tools for restaurant search and image analysis.
 
 from .rag_text_tool import RAGTextTool
 from .rag_image_tool import RAGImageTool
-from .image_qa_tool import ImageQATool
+from .image_qa_tool import ImageQATool, ImageQABatchTool
 from .toolkit import CustomToolkit
 
 __all__ = [
     "RAGTextTool",
     "RAGImageTool", 
     "ImageQATool",
+    "ImageQABatchTool",
     "CustomToolkit",
 ]
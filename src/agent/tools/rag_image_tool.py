@@ -1,6 +1,12 @@
+import asyncio
 from typing import Optional, Type
+from concurrent.futures import Executor
 from pydantic import BaseModel, Field
 from langchain.tools import BaseTool
+import orjson
+import logging
+
+logger = logging.getLogger(__name__)
 
 
 class RAGImageInput(BaseModel):
@@ -36,36 +42,30 @@ class RAGImageTool(BaseTool):
     args_schema: Type[BaseModel] = RAGImageInput
     
     retriever: Optional[object] = Field(default=None, exclude=True)
-    _indices_loaded: bool = False
+    executor: Optional[Executor] = Field(default=None, exclude=True)
     
     def __init__(self, retriever=None, **kwargs):
         super().__init__(**kwargs)
         self.retriever = retriever
-        self._indices_loaded = False
     
     def _run(self, image_path: str, k: int = 5) -> str:
         """Execute the image similarity search."""
         try:
-            # Load indices once
-            if not self._indices_loaded and self.retriever:
-                self.retriever.load_indices()
-                self._indices_loaded = True
-            
-            # Search for similar restaurants
+            # Search for similar restaurants (the retriever loads its indices on first use)
             results = self.retriever.search_image(image_path, k=k)
             
             if not results:
                 return "No similar restaurants found for the provided image."
             
-            # Return results as JSON string (includes similarity scores in metadata)
-            import json
-            return json.dumps(results, indent=2)
+            # Return results as compact JSON string (includes similarity scores in metadata);
+            # indentation would only cost LLM tokens
+            return orjson.dumps(results, option=orjson.OPT_SERIALIZE_NUMPY).decode()
             
         except Exception as e:
-            import traceback
-            error_details = traceback.format_exc()
-            return f"Error retrieving similar restaurants: {str(e)}\n\nDetails:\n{error_details}"
+            # Logged, not returned to the agent (see toolkit.py)
+            logger.exception("Image retrieval failed for %s", image_path)
+            return f"Error retrieving similar restaurants: {e}"
     
     async def _arun(self, image_path: str, k: int = 5) -> str:
-        """Async version - delegates to sync for now."""
-        return self._run(image_path, k)
+        """Async version - runs the sync tool on the toolkit's shared pool so parallel calls overlap."""
+        return await asyncio.get_running_loop().run_in_executor(self.executor, self._run, image_path, k)
@@ -3,9 +3,15 @@ RAG Text Retrieval Tool
 Searches for restaurants based on text queries using the multimodal retriever.
 """
 
+import asyncio
 from typing import Optional, Type
+from concurrent.futures import Executor
 from pydantic import BaseModel, Field
 from langchain.tools import BaseTool
+import orjson
+import logging
+
+logger = logging.getLogger(__name__)
 
 
 class RAGTextInput(BaseModel):
@@ -41,36 +47,29 @@ class RAGTextTool(BaseTool):
     args_schema: Type[BaseModel] = RAGTextInput
     
     retriever: Optional[object] = Field(default=None, exclude=True)
-    _indices_loaded: bool = False
+    executor: Optional[Executor] = Field(default=None, exclude=True)
     
     def __init__(self, retriever=None, **kwargs):
         super().__init__(**kwargs)
         self.retriever = retriever
-        self._indices_loaded = False
     
     def _run(self, query: str, k: int = 5) -> str:
         """Execute the text search."""
         try:
-            # Load indices once
-            if not self._indices_loaded and self.retriever:
-                self.retriever.load_indices()
-                self._indices_loaded = True
-            
-            # Search for restaurants
+            # Search for restaurants (the retriever loads its indices on first use)
             results = self.retriever.search_text(query, k=k)
             
             if not results:
                 return "No restaurants found matching your query."
             
-            # Return results as JSON string
-            import json
-            return json.dumps(results, indent=2)
+            # Return results as compact JSON string; indentation would only cost LLM tokens
+            return orjson.dumps(results, option=orjson.OPT_SERIALIZE_NUMPY).decode()
             
         except Exception as e:
-            import traceback
-            error_details = traceback.format_exc()
-            return f"Error retrieving restaurants: {str(e)}\n\nDetails:\n{error_details}"
+            # Logged, not returned to the agent (see toolkit.py)
+            logger.exception("Text retrieval failed for %r", query)
+            return f"Error retrieving restaurants: {e}"
     
     async def _arun(self, query: str, k: int = 5) -> str:
-        """Async version - delegates to sync for now."""
-        return self._run(query, k)
+        """Async version - runs the sync tool on the toolkit's shared pool so parallel calls overlap."""
+        return await asyncio.get_running_loop().run_in_executor(self.executor, self._run, query, k)
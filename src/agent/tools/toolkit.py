@@ -3,20 +3,28 @@ Custom Toolkit for FoodFinder Agent
 Manages tool instances and automatically passes shared dependencies.
 """
 
+import os
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Any, Optional
 from pydantic import BaseModel, Field
 from langchain_core.tools import BaseTool
 
 from .rag_text_tool import RAGTextTool
 from .rag_image_tool import RAGImageTool
-from .image_qa_tool import ImageQATool
+from .image_qa_tool import ImageQATool, ImageQABatchTool
+
+# One pool for every toolkit's tool calls and image decoding, so I/O of concurrent
+# requests overlaps with model compute instead of each call spawning its own threads.
+# Tools catch their own errors there: the traceback goes to the log and the agent only
+# gets the error message, which keeps stack frames out of the LLM context.
+_IO_POOL = ThreadPoolExecutor(max_workers=max(4, os.cpu_count() or 1), thread_name_prefix="foodfinder-tools")
 
 
 class CustomToolkit(BaseModel):
     """
     Toolkit that manages FoodFinder agent tools and their dependencies.
     
-    Automatically injects shared dependencies (retriever, LLM) into tools
+    Automatically injects shared dependencies (retriever, LLM, thread pool) into tools
     and provides a clean interface for the agent to access all tools.
     """
     
@@ -53,13 +61,15 @@ class CustomToolkit(BaseModel):
         
         # Add RAG text tool (requires retriever)
         if self.retriever is not None:
-            tools.append(RAGTextTool(retriever=self.retriever))
+            tools.append(RAGTextTool(retriever=self.retriever, executor=_IO_POOL))
         
         # Add RAG image tool (requires retriever)
         if self.retriever is not None:
-            tools.append(RAGImageTool(retriever=self.retriever))
+            tools.append(RAGImageTool(retriever=self.retriever, executor=_IO_POOL))
         
-        # Add image QA tool (standalone, uses CLIP)
-        tools.append(ImageQATool())
+        # Add image QA tools (standalone, uses CLIP); the batch variant shares the model
+        image_qa = ImageQATool(executor=_IO_POOL)
+        tools.append(image_qa)
+        tools.append(ImageQABatchTool(qa_tool=image_qa, executor=_IO_POOL))
         
         return tools
@@ -1,100 +1,187 @@
-from transformers import CLIPProcessor, CLIPModel
-from PIL import Image
+from transformers import CLIPModel
 import torch
+from torch.utils.data import Dataset, DataLoader
 import numpy as np
-from typing import List
+import contextlib
+import functools
+import os
+from concurrent.futures import Executor, ThreadPoolExecutor
+from tqdm import tqdm
+from typing import List, Optional
+
+from src.utils.image_transforms import clip_transform, read_rgb
+from src.utils.onnx_clip import load_vision_session, run_vision_session
+
+class _ImageDataset(Dataset):
+    """Decodes and preprocesses images so DataLoader workers can run ahead of the model."""
+    
+    def __init__(self, image_paths: List[str], transform, executor: Optional[Executor] = None):
+        self.image_paths = image_paths
+        self.transform = transform
+        self.executor = executor
+    
+    def __len__(self):
+        return len(self.image_paths)
+    
+    def __getitem__(self, idx: int):
+        path = self.image_paths[idx]
+        # Decoding raises on corrupt data, so there is no separate verify() pass.
+        # Resize/crop/normalize run as tensor ops instead of CLIPProcessor's per-image Python
+        try:
+            pixel_values = self.transform(read_rgb(path))
+        except Exception:
+            return idx, None
+        return idx, pixel_values
+    
+    def __getitems__(self, indices: List[int]):
+        """Fetch a whole batch; with an executor, its images are decoded on threads (decoding releases the GIL)."""
+        if self.executor is None:
+            return [self[idx] for idx in indices]
+        return list(self.executor.map(self.__getitem__, indices))
+
+def _collate_images(batch):
+    """Stack valid images of a batch, returning (global indices, pixel_values, skipped count)."""
+    valid = [(idx, pixel_values) for idx, pixel_values in batch if pixel_values is not None]
+    if not valid:
+        return [], None, len(batch)
+    indices = [idx for idx, _ in valid]
+    pixel_values = torch.stack([pixel_values for _, pixel_values in valid])
+    return indices, pixel_values, len(batch) - len(valid)
 
 class ImageEmbedder:
     def __init__(self, model_name: str = "openai/clip-vit-base-patch32", verbose: bool = True):
         self.device = "cuda" if torch.cuda.is_available() else "cpu"
         self.model = CLIPModel.from_pretrained(model_name).to(self.device)
-        self.processor = CLIPProcessor.from_pretrained(model_name)
         self.dimension = 512
         self.model.eval()
+        if self.device == "cuda":
+            # FP16 weights halve the memory traffic of every forward pass; outputs are cast back
+            # to float32 before they leave the embedder
+            self.model.half()
+        self.transform = clip_transform(self.model.config.vision_config.image_size)
+        # On CPU, run the vision encoder through the fp32 ONNX Runtime export when it has been
+        # exported (None otherwise). Not int8: index and query embeddings must match.
+        self.vision_session = load_vision_session(model_name, quantized=False) if self.device == "cpu" else None
+        # Recent query embeddings, keyed by path, mtime and size so an edited file misses
+        self._embed_cached = functools.lru_cache(maxsize=1024)(self._embed_file)
         if verbose:
-            print(f"Loaded image embedder on {self.device}: {model_name}")
+            backend = "ONNX Runtime" if self.vision_session is not None else self.device
+            print(f"Loaded image embedder on {backend}: {model_name}")
     
-    def embed_batch(self, image_paths: List[str], batch_size: int = 32, return_indices: bool = False):
-        from tqdm import tqdm
-        embeddings = []
-        skipped = 0
-        all_valid_indices = []
+    def _encode_tensor(self, pixel_values: torch.Tensor) -> torch.Tensor:
+        """float32 CLIP image embeddings [B, 512] of preprocessed pixel_values, on the model's device."""
+        if self.vision_session is not None:
+            image_features = run_vision_session(self.vision_session, pixel_values)
+            if image_features is not None:
+                return image_features
+            self.vision_session = None  # fall back to the PyTorch model (same fp32 embeddings)
         
-        num_batches = (len(image_paths) + batch_size - 1) // batch_size
+        pixel_values = pixel_values.to(self.device, dtype=self.model.dtype, non_blocking=True)
         
-        for i in tqdm(range(0, len(image_paths), batch_size), 
-                     total=num_batches,
-                     desc="Embedding images",
-                     unit="batch"):
-            batch_paths = image_paths[i:i+batch_size]
-            
-            # Load images with error handling
-            images = []
-            valid_indices = []
-            for idx, path in enumerate(batch_paths):
-                try:
-                    img = Image.open(path)
-                    img.verify()  # Verify it's a valid image
-                    img = Image.open(path)  # Reopen after verify
-                    img = img.convert("RGB")
-                    images.append(img)
-                    valid_indices.append(i + idx)  # Global index
-                except Exception as e:
-                    skipped += 1
-                    continue
-            
-            if len(images) == 0:
-                continue
-            
-            inputs = self.processor(images=images, return_tensors="pt")
-            inputs = {k: v.to(self.device) for k, v in inputs.items()}
-            
-            with torch.no_grad():
-                image_features = self.model.get_image_features(**inputs)
+        # FP16 on GPU (weights are already half); autocast keeps numerically sensitive
+        # ops such as layer norm and softmax in FP32
+        with torch.inference_mode(), torch.autocast("cuda", dtype=torch.float16,
+                                                    enabled=self.device == "cuda"):
+            image_features = self.model.get_image_features(pixel_values=pixel_values)
             
             # CLIP returns BaseModelOutputWithPooling with pooler_output attribute
             # pooler_output has shape (batch_size, hidden_dim) which is what we need
-            if hasattr(image_features, 'pooler_output'):
-                embeddings.append(image_features.pooler_output.cpu().numpy())
-            else:
-                # Fallback for direct tensor output
-                embeddings.append(image_features.cpu().numpy())
-            
-            all_valid_indices.extend(valid_indices)
-            
-            # Clear GPU cache periodically
-            if (i // batch_size) % 100 == 0 and torch.cuda.is_available():
-                torch.cuda.empty_cache()
+            image_features = getattr(image_features, 'pooler_output', image_features)
+            return image_features.float()
+    
+    def _encode(self, pixel_values: torch.Tensor) -> np.ndarray:
+        """float32 CLIP image embeddings [B, 512] of preprocessed pixel_values, as a host array."""
+        # Contiguous float32, so FAISS takes the array without another cast or copy
+        return self._encode_tensor(pixel_values).contiguous().cpu().numpy()
+    
+    def embed_batch(self, image_paths: List[str], batch_size: int = 32, return_indices: bool = False,
+                    num_workers: int = None, show_progress: bool = True):
+        # Batches are written straight into one preallocated array (no list + vstack copy)
+        result = np.empty((len(image_paths), self.dimension), dtype=np.float32)
+        valid_mask = np.zeros(len(image_paths), dtype=bool)
+        skipped = 0
+        
+        num_batches = (len(image_paths) + batch_size - 1) // batch_size
+        if num_workers is None:
+            num_workers = min(8, os.cpu_count() or 1)
+        
+        # Without worker processes (e.g. small query batches), still decode each batch on threads
+        decode_pool = ThreadPoolExecutor(max_workers=min(16, os.cpu_count() or 1)) if num_workers == 0 else None
+        
+        # Workers decode/preprocess upcoming batches while the model runs on the current one
+        loader = DataLoader(
+            _ImageDataset(image_paths, self.transform, executor=decode_pool),
+            batch_size=batch_size,
+            num_workers=num_workers,
+            collate_fn=_collate_images,
+            pin_memory=self.device == "cuda",
+            prefetch_factor=2 if num_workers > 0 else None,
+        )
+        
+        # On GPU, features are copied into two alternating pinned host buffers without
+        # blocking; a batch is written to result only after the next one has been queued,
+        # so the GPU never idles waiting for the host
+        use_cuda = self.device == "cuda" and self.vision_session is None
+        host_buffers = [torch.empty((batch_size, self.dimension), dtype=torch.float32, pin_memory=True)
+                        for _ in range(2)] if use_cuda else None
+        pending = None
+        
+        def flush(batch):
+            valid_indices, features, copied = batch
+            copied.synchronize()
+            result[valid_indices] = features.numpy()
+            valid_mask[valid_indices] = True
+        
+        with decode_pool or contextlib.nullcontext():
+            for valid_indices, pixel_values, batch_skipped in tqdm(
+                    loader, total=num_batches, desc="Embedding images", unit="batch", disable=not show_progress):
+                skipped += batch_skipped
+                if pixel_values is None:
+                    continue
+                
+                if not use_cuda:
+                    result[valid_indices] = self._encode(pixel_values)
+                    valid_mask[valid_indices] = True
+                    continue
+                
+                features = host_buffers[0][:len(valid_indices)]
+                host_buffers.reverse()
+                features.copy_(self._encode_tensor(pixel_values), non_blocking=True)
+                copied = torch.cuda.Event()
+                copied.record()
+                if pending is not None:
+                    flush(pending)
+                pending = (valid_indices, features, copied)
+        
+        if pending is not None:
+            flush(pending)
         
         if skipped > 0:
             print(f"\n⚠️  Skipped {skipped} corrupted/invalid images")
         
-        if len(embeddings) == 0:
-            # No valid images
-            result = np.array([]).reshape(0, 512)  # Empty array with correct shape
-        else:
-            # Stack all embeddings into single array
-            result = np.vstack(embeddings)
+        # Compact only if some images were skipped
+        if skipped > 0:
+            result = result[valid_mask]
         
         if return_indices:
-            return result, all_valid_indices
+            return result, np.flatnonzero(valid_mask).tolist()
         return result
 
     
-    def embed(self, image_path: str) -> np.ndarray:
-        image = Image.open(image_path).convert("RGB")
-        inputs = self.processor(images=image, return_tensors="pt")
-        inputs = {k: v.to(self.device) for k, v in inputs.items()}
-        
-        with torch.no_grad():
-            image_features = self.model.get_image_features(**inputs)
+    def _embed_file(self, image_path: str, mtime_ns: int, size: int) -> torch.Tensor:
+        # Decode in C and preprocess as tensor ops on the model's device (no PIL round-trip)
+        pixel_values = self.transform(read_rgb(image_path).to(self.device)).unsqueeze(0)
+        return self._encode_tensor(pixel_values)[0]
+    
+    def embed_tensor(self, image_path: str) -> torch.Tensor:
+        """Embedding of one image as a float32 tensor left on the model's device.
         
-        # Handle BaseModelOutputWithPooling
-        if hasattr(image_features, 'pooler_output'):
-            return image_features.pooler_output.cpu().numpy()[0]
-        else:
-            return image_features.cpu().numpy()[0]
-
-
-
-
+        Repeated queries of an unchanged file are served from an LRU cache; don't modify
+        the returned tensor in place.
+        """
+        stat = os.stat(image_path)
+        return self._embed_cached(image_path, stat.st_mtime_ns, stat.st_size)
+    
+    def embed(self, image_path: str) -> np.ndarray:
+        # Copy: on CPU, .numpy() would share memory with the cached tensor
+        return self.embed_tensor(image_path).cpu().numpy().copy()
@@ -1,21 +1,61 @@
 from sentence_transformers import SentenceTransformer
+import functools
 import numpy as np
+import torch
 from typing import List
 
+DEFAULT_MODEL_NAME = "sentence-transformers/all-mpnet-base-v2"
+
+def weights_dtype() -> str:
+    """Precision TextEmbedder loads its weights in on this host: FP16 on CUDA, else FP32."""
+    return "float16" if torch.cuda.is_available() else "float32"
+
 class TextEmbedder:
-    def __init__(self, model_name: str = "sentence-transformers/all-mpnet-base-v2", verbose: bool = True):
-        self.model = SentenceTransformer(model_name)
+    def __init__(self, model_name: str = DEFAULT_MODEL_NAME, verbose: bool = True):
+        self.model_name = model_name
+        self.model = SentenceTransformer(model_name, tokenizer_kwargs={"use_fast": True})
+        self.dtype = weights_dtype()
+        if self.dtype == "float16":
+            self.model.half()
         self.dimension = 768
+        # Recent query embeddings; the agent often repeats a search within a conversation
+        self._embed_cached = functools.lru_cache(maxsize=1024)(self._embed_text)
         if verbose:
             print(f"Loaded text embedder: {model_name}")
     
-    def embed_batch(self, texts: List[str], batch_size: int = 64) -> np.ndarray:
-        return self.model.encode(
-            texts,
-            batch_size=batch_size,
-            show_progress_bar=True,
-            convert_to_numpy=True
-        )
+    def embed_batch(self, texts: List[str], batch_size: int = 64, show_progress: bool = True) -> np.ndarray:
+        # FP16 autocast on GPU: less memory per batch, so larger batches fit
+        with torch.inference_mode(), torch.autocast("cuda", dtype=torch.float16,
+                                                    enabled=torch.cuda.is_available()):
+            embeddings = self.model.encode(
+                texts,
+                batch_size=batch_size,
+                show_progress_bar=show_progress,
+                convert_to_numpy=True
+            )
+        return embeddings.astype(np.float32, copy=False)
+    
+    def embed_many(self, texts: List[str], batch_size: int = 128, show_progress: bool = True) -> np.ndarray:
+        """Embed a large corpus, sharded across all GPUs when there is more than one.
+        
+        With a single device this is embed_batch; the worker pool only pays off when
+        each process gets a GPU of its own.
+        """
+        if torch.cuda.device_count() < 2:
+            return self.embed_batch(texts, batch_size=batch_size, show_progress=show_progress)
+        
+        pool = self.model.start_multi_process_pool()
+        try:
+            embeddings = self.model.encode_multi_process(
+                texts, pool, batch_size=batch_size, show_progress_bar=show_progress
+            )
+        finally:
+            self.model.stop_multi_process_pool(pool)
+        return embeddings.astype(np.float32, copy=False)
+    
+    def _embed_text(self, text: str) -> np.ndarray:
+        return self.model.encode([text], convert_to_numpy=True)[0].astype(np.float32, copy=False)
     
     def embed(self, text: str) -> np.ndarray:
-        return self.model.encode([text], convert_to_numpy=True)[0]
+        # Copy so callers can't modify the cached array
+        return self._embed_cached(text).copy()
@@ -0,0 +1,37 @@
+"""
+Tensor-based CLIP image preprocessing
+Decodes images with torchvision (libjpeg-turbo, no PIL round-trip) and applies the
+CLIP resize/crop/normalize as tensor ops, on the GPU when the tensor lives there.
+Matches CLIPProcessor's output up to resampling differences.
+"""
+
+import torch
+from PIL import Image
+from torchvision.io import read_image, ImageReadMode
+from torchvision.transforms import v2
+
+# Normalization constants of the OpenAI CLIP checkpoints
+CLIP_MEAN = (0.48145466, 0.4578275, 0.40821073)
+CLIP_STD = (0.26862954, 0.26130258, 0.27577711)
+
+
+def clip_transform(image_size: int = 224) -> v2.Compose:
+    """uint8 [3, H, W] (or [B, 3, H, W]) image tensor -> normalized float32 pixel_values."""
+    return v2.Compose([
+        v2.Resize(image_size, interpolation=v2.InterpolationMode.BICUBIC, antialias=True),
+        v2.CenterCrop(image_size),
+        v2.ToDtype(torch.float32, scale=True),
+        v2.Normalize(CLIP_MEAN, CLIP_STD),
+    ])
+
+
+def read_rgb(image_path: str) -> torch.Tensor:
+    """Decode an image file to a uint8 RGB tensor [3, H, W].
+
+    JPEG/PNG/GIF/WebP are decoded by torchvision; anything else falls back to PIL.
+    """
+    try:
+        return read_image(image_path, mode=ImageReadMode.RGB)
+    except RuntimeError:
+        with Image.open(image_path) as image:
+            return v2.functional.pil_to_tensor(image.convert("RGB"))
@@ -0,0 +1,118 @@
+"""
+ONNX Runtime backend for the CLIP vision encoder
+scripts/export_onnx.py exports the encoder (fp32 and int8) ahead of time; sessions are served
+with ONNX Runtime, whose fused CPU kernels run a ViT noticeably faster than eager PyTorch.
+Without onnxruntime, an export, or a working session, callers keep using the PyTorch model.
+"""
+
+import functools
+import logging
+import os
+from pathlib import Path
+from typing import Optional
+
+import torch
+from transformers import CLIPModel
+
+try:
+    import onnxruntime as ort
+    from onnxruntime.quantization import quantize_dynamic, QuantType
+except ImportError:
+    ort = None
+
+logger = logging.getLogger(__name__)
+
+# Exported models live next to the code, not in the working directory
+ONNX_DIR = Path(__file__).parent.parent.parent / "models" / "onnx"
+
+
+def onnx_available() -> bool:
+    return ort is not None
+
+
+class _VisionEncoder(torch.nn.Module):
+    """CLIP image tower + projection, i.e. CLIPModel.get_image_features as a plain module."""
+
+    def __init__(self, model: CLIPModel):
+        super().__init__()
+        self.model = model
+
+    def forward(self, pixel_values: torch.Tensor) -> torch.Tensor:
+        features = self.model.get_image_features(pixel_values=pixel_values)
+        return getattr(features, 'pooler_output', features)
+
+
+def vision_model_path(model_name: str, quantized: bool = True, onnx_dir: Path = ONNX_DIR) -> Path:
+    """Path of the (int8 or fp32) vision encoder exported for model_name."""
+    suffix = "_int8" if quantized else ""
+    return Path(onnx_dir) / f"{model_name.replace('/', '__')}_vision{suffix}.onnx"
+
+
+def export_vision_encoder(model_name: str, quantized: bool = True, onnx_dir: Path = ONNX_DIR) -> Path:
+    """Export the CLIP vision encoder to ONNX (dynamic batch), optionally quantized to int8.
+
+    Int8 suits zero-shot scoring; embeddings stored in or queried against an index
+    should come from the fp32 export, which matches PyTorch to ~1e-6.
+    """
+    fp32_path = vision_model_path(model_name, quantized=False, onnx_dir=onnx_dir)
+    fp32_path.parent.mkdir(parents=True, exist_ok=True)
+
+    # The int8 model is quantized from the fp32 export, which is kept for fp32 sessions.
+    # Both are written to a temporary file first, so a failed export leaves no partial model.
+    if not fp32_path.exists():
+        model = CLIPModel.from_pretrained(model_name).eval()
+        image_size = model.config.vision_config.image_size
+        tmp_path = fp32_path.with_suffix(".tmp")
+        torch.onnx.export(
+            _VisionEncoder(model),
+            (torch.zeros(1, 3, image_size, image_size),),
+            str(tmp_path),
+            input_names=["pixel_values"],
+            output_names=["image_embeds"],
+            dynamic_axes={"pixel_values": {0: "batch"}, "image_embeds": {0: "batch"}},
+            opset_version=17,
+            dynamo=False,
+        )
+        os.replace(tmp_path, fp32_path)
+    if not quantized:
+        return fp32_path
+
+    int8_path = vision_model_path(model_name, quantized=True, onnx_dir=onnx_dir)
+    tmp_path = int8_path.with_suffix(".tmp")
+    quantize_dynamic(str(fp32_path), str(tmp_path), weight_type=QuantType.QInt8)
+    os.replace(tmp_path, int8_path)
+    return int8_path
+
+
+@functools.lru_cache(maxsize=4)
+def load_vision_session(model_name: str, quantized: bool = True) -> Optional["ort.InferenceSession"]:
+    """ONNX Runtime session for the exported vision encoder, or None if onnxruntime isn't
+    installed, the model hasn't been exported (scripts/export_onnx.py), or it fails to load.
+
+    The session takes float32 "pixel_values" [B, 3, H, W] and returns "image_embeds" [B, D].
+    """
+    if ort is None:
+        return None
+
+    onnx_path = vision_model_path(model_name, quantized=quantized)
+    if not onnx_path.exists():
+        logger.info("No ONNX export at %s (run scripts/export_onnx.py); using PyTorch", onnx_path)
+        return None
+
+    options = ort.SessionOptions()
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    try:
+        return ort.InferenceSession(str(onnx_path), options, providers=["CPUExecutionProvider"])
+    except Exception:
+        logger.warning("Could not load %s; using PyTorch", onnx_path, exc_info=True)
+        return None
+
+
+def run_vision_session(session: "ort.InferenceSession", pixel_values: torch.Tensor) -> Optional[torch.Tensor]:
+    """float32 image embeddings [B, D] from a load_vision_session session, or None if
+    ONNX Runtime fails (the caller then falls back to the PyTorch model)."""
+    try:
+        return torch.from_numpy(session.run(None, {"pixel_values": pixel_values.float().numpy()})[0])
+    except Exception:
+        logger.warning("ONNX Runtime vision encoder failed; using PyTorch", exc_info=True)
+        return None
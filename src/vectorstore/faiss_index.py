@@ -1,26 +1,204 @@
 import faiss
+import faiss.contrib.torch_utils  # index.search also takes torch tensors (numpy unchanged)
+import logging
 import numpy as np
-import pickle
+import os
+import pyarrow as pa
+import pyarrow.compute as pc
+import torch
 from pathlib import Path
-from typing import List, Tuple, Optional
+from typing import List, Tuple, Optional, Sequence, Union
+
+from .metadata_store import save_metadata, read_metadata, table_rows
+
+logger = logging.getLogger(__name__)
+
+# "ip" is cosine similarity: vectors are L2-normalized on add and search
+METRICS = {"l2": faiss.METRIC_L2, "ip": faiss.METRIC_INNER_PRODUCT}
+
+# IVF training samples this many vectors per list at most; more doesn't improve the centroids
+TRAIN_POINTS_PER_LIST = 256
+
+# OpenMP threads for batched searches: about the physical cores, since hyperthreads only
+# thrash the cache on flat scans. Single queries use one thread (waking a team costs more
+# than it saves). The setting is per calling thread and restored after each search, so
+# concurrent searches and the caller's other OpenMP work don't interfere.
+SEARCH_THREADS = max(1, (os.cpu_count() or 2) // 2)
 
 class FAISSIndex:
-    def __init__(self, dimension: int, index_type: str = "Flat"):
+    def __init__(self, dimension: int, index_type: str = "Flat", nprobe: int = 16, metric: str = "ip",
+                 search_threads: int = SEARCH_THREADS):
+        """
+        Args:
+            dimension: Embedding dimension
+            index_type: "Flat", "IVF", or any faiss.index_factory string (e.g. "SQfp16",
+                "IVF1024,Flat", "HNSW32", "IVF1024,PQ64")
+            nprobe: Number of inverted lists visited per query for IVF indexes
+            metric: "ip" (cosine similarity on normalized vectors) or "l2"; a loaded index
+                keeps the metric it was built with
+            search_threads: OpenMP threads for multi-query searches on the CPU
+        """
+        if metric not in METRICS:
+            raise ValueError(f"Unknown metric: {metric}")
         self.dimension = dimension
         self.index_type = index_type
+        self.nprobe = nprobe
+        self.metric = metric
+        self.search_threads = search_threads
         self.index = None
-        self.metadata = []
+        # Row dicts, or a pa.Table (as loaded or added) whose rows are only decoded for search hits
+        self.metadata: Union[List[dict], pa.Table] = []
+        self.gpu_resources = None
+        self._host_copy = None  # CPU copy of a GPU index, for filtered searches (see _search_filtered)
         
     def create_index(self):
+        metric_type = METRICS[self.metric]
         if self.index_type == "Flat":
-            self.index = faiss.IndexFlatL2(self.dimension)
+            self.index = faiss.IndexFlat(self.dimension, metric_type)
         elif self.index_type == "IVF":
-            quantizer = faiss.IndexFlatL2(self.dimension)
-            self.index = faiss.IndexIVFFlat(quantizer, self.dimension, 100)
+            quantizer = faiss.IndexFlat(self.dimension, metric_type)
+            self.index = faiss.IndexIVFFlat(quantizer, self.dimension, 100, metric_type)
         else:
-            raise ValueError(f"Unknown index type: {self.index_type}")
+            try:
+                self.index = faiss.index_factory(self.dimension, self.index_type, metric_type)
+            except RuntimeError as e:
+                raise ValueError(f"Unknown index type: {self.index_type}") from e
+        
+        # Vectors carry explicit int64 ids (their metadata row numbers), kept by FAISS in C++
+        self.index = faiss.IndexIDMap2(self.index)
+        
+        # nprobe is serialized with IVF indexes, so it carries over to load()
+        ivf = self.ivf_index()
+        if ivf is not None:
+            ivf.nprobe = self.nprobe
+    
+    @staticmethod
+    def gpu_available() -> bool:
+        """True if this FAISS build has GPU support and a GPU is visible."""
+        return hasattr(faiss, "StandardGpuResources") and faiss.get_num_gpus() > 0
+    
+    @property
+    def on_gpu(self) -> bool:
+        return self.gpu_resources is not None
+    
+    def to_gpu(self, device: int = 0, use_float16: bool = True):
+        """Move the index to a GPU (FP16 storage by default); no-op without GPU support."""
+        if self.on_gpu or not self.gpu_available():
+            return self
+        if self.index is None:
+            self.create_index()
+        
+        # The resources object must outlive the GPU index, so keep it on self
+        gpu_resources = faiss.StandardGpuResources()
+        co = faiss.GpuClonerOptions()
+        co.useFloat16 = use_float16
+        try:
+            self.index = faiss.index_cpu_to_gpu(gpu_resources, device, self.index, co)
+        except RuntimeError:
+            # Not every index type has a GPU version (e.g. flat SQfp16); search it on the CPU
+            logger.warning("Index has no GPU version; keeping it on the CPU", exc_info=True)
+            return self
+        self.gpu_resources = gpu_resources
+        self._host_copy = None
+        return self
+    
+    def to_cpu(self):
+        """Move a GPU index back to host memory."""
+        if self.on_gpu:
+            self.index = faiss.index_gpu_to_cpu(self.index)
+            self.gpu_resources = None
+            self._host_copy = None
+        return self
+    
+    def move_invlists_to_disk(self, ivfdata_path: str):
+        """Move an IVF index's inverted lists into ivfdata_path (no-op for non-IVF indexes).
+        
+        The saved index then references that file, and load() memory-maps it instead of
+        reading the lists into RAM, so several processes can share one copy.
+        """
+        self.to_cpu()
+        ivf = self.ivf_index()
+        if ivf is None:
+            return self
+        
+        Path(ivfdata_path).parent.mkdir(parents=True, exist_ok=True)
+        Path(ivfdata_path).unlink(missing_ok=True)  # don't append to lists from a previous build
+        invlists = faiss.OnDiskInvertedLists(ivf.nlist, ivf.code_size, ivfdata_path)
+        sources = faiss.InvertedListsPtrVector()
+        sources.push_back(ivf.invlists)
+        invlists.merge_from_multiple(sources.data(), sources.size(), False)
+        
+        # The index takes ownership of the new lists (and frees the in-memory ones)
+        ivf.replace_invlists(invlists, True)
+        invlists.this.disown()
+        return self
+    
+    def ivf_index(self):
+        """Return the underlying IndexIVF, or None if this is not an IVF index."""
+        try:
+            return faiss.extract_index_ivf(self.index)
+        except RuntimeError:
+            return None
+    
+    def similarity(self, distances: np.ndarray) -> np.ndarray:
+        """Map search distances to similarities in which higher is better."""
+        if self.metric == "ip":
+            return distances  # already cosine similarities
+        return 1 / (1 + distances)
+    
+    def _prepare(self, embeddings: np.ndarray) -> np.ndarray:
+        """C-contiguous float32 vectors for FAISS, normalized for the inner-product metric.
+        
+        float32 C-contiguous input is used without a copy. normalize_L2 works in place, so
+        for IP such input is copied (once) to leave the caller's (or a cached) array intact;
+        an array the cast already had to allocate is normalized as-is.
+        """
+        vectors = np.ascontiguousarray(embeddings, dtype=np.float32)
+        if self.metric != "ip":
+            return vectors
+        if np.may_share_memory(vectors, embeddings):
+            vectors = vectors.copy()
+        faiss.normalize_L2(vectors)
+        return vectors
     
-    def add(self, embeddings: np.ndarray, metadata: List[dict]):
+    def _training_sample(self, vectors: np.ndarray) -> np.ndarray:
+        """Random subset of the vectors large enough to train the IVF centroids."""
+        ivf = self.ivf_index()
+        if ivf is None or len(vectors) <= TRAIN_POINTS_PER_LIST * ivf.nlist:
+            return vectors
+        rng = np.random.default_rng(0)
+        return vectors[rng.choice(len(vectors), TRAIN_POINTS_PER_LIST * ivf.nlist, replace=False)]
+    
+    def metadata_rows(self, ids: Optional[Sequence[int]] = None) -> List[dict]:
+        """Metadata of the vectors at the given positions (all of them if None) as dicts."""
+        if isinstance(self.metadata, pa.Table):
+            table = self.metadata if ids is None else self.metadata.take(pa.array(ids, type=pa.int64()))
+            return table_rows(table)
+        return list(self.metadata) if ids is None else [self.metadata[i] for i in ids]
+    
+    def ids_where(self, condition: pc.Expression) -> np.ndarray:
+        """Positions of the metadata rows matching a pyarrow.compute expression,
+        e.g. pc.field("price_range") <= 2, for use as search(..., ids=...).
+        
+        Only flat columns can be tested (nested ones are stored as JSON strings).
+        """
+        table = self.metadata
+        if not isinstance(table, pa.Table):
+            table = pa.Table.from_pylist([
+                {key: value for key, value in row.items() if not isinstance(value, (dict, list, tuple))}
+                for row in table
+            ])
+        positions = pa.array(np.arange(len(table), dtype=np.int64))
+        return table.append_column("__position", positions).filter(condition)["__position"].to_numpy()
+    
+    def reconstruct_all(self) -> np.ndarray:
+        """Return every stored vector in insertion order, e.g. to reuse them in a rebuild."""
+        ivf = self.ivf_index()
+        if ivf is not None:
+            ivf.make_direct_map()
+        return self.index.reconstruct_n(0, self.index.ntotal)
+
+    def add(self, embeddings: np.ndarray, metadata: Union[List[dict], pa.Table]):
         if self.index is None:
             self.create_index()
         
@@ -34,35 +212,130 @@ class FAISSIndex:
         if len(embeddings) != len(metadata):
             raise ValueError(f"Number of embeddings ({len(embeddings)}) must match metadata ({len(metadata)})")
         
+        vectors = self._prepare(embeddings)
         if hasattr(self.index, 'is_trained') and not self.index.is_trained:
-            self.index.train(embeddings.astype('float32'))
+            self.index.train(self._training_sample(vectors))
         
-        self.index.add(embeddings.astype('float32'))
-        self.metadata.extend(metadata)
+        if isinstance(self.index, faiss.IndexIDMap2):
+            ids = np.arange(self.index.ntotal, self.index.ntotal + len(vectors), dtype=np.int64)
+            self.index.add_with_ids(vectors, ids)
+        else:
+            self.index.add(vectors)  # indexes saved before ids were explicit
+        self._host_copy = None
+        if isinstance(metadata, pa.Table) and len(self.metadata) == 0:
+            # Columnar metadata is kept as-is (and saved as-is)
+            self.metadata = metadata
+        else:
+            if isinstance(self.metadata, pa.Table):
+                self.metadata = self.metadata_rows()
+            self.metadata.extend(table_rows(metadata) if isinstance(metadata, pa.Table) else metadata)
         
         print(f"Added {len(embeddings)} vectors. Total: {self.index.ntotal}")
     
-    def search(self, query_embedding: np.ndarray, k: int = 10) -> Tuple[np.ndarray, List[dict]]:
-        query = query_embedding.astype('float32').reshape(1, -1)
-        distances, indices = self.index.search(query, k)
+    def search(self, query_embedding: Union[np.ndarray, torch.Tensor], k: int = 10,
+               ids: Optional[np.ndarray] = None) -> Tuple[np.ndarray, List[dict]]:
+        distances, results = self.search_batch(query_embedding.reshape(1, -1), k, ids=ids)
+        return distances[0], results[0]
+    
+    def search_batch(self, query_embeddings: Union[np.ndarray, torch.Tensor], k: int = 10,
+                     ids: Optional[np.ndarray] = None) -> Tuple[np.ndarray, List[List[dict]]]:
+        """Search several queries in one call, which FAISS parallelizes across queries.
+        
+        Queries may be a torch tensor: a GPU index searches it where it is; a CPU index
+        gets a host copy. ids (e.g. from ids_where) restricts the search to those
+        positions. Returns distances of shape (n_queries, k) and one metadata list per query.
+        """
+        gpu_index = self._gpu_index()
+        if isinstance(query_embeddings, torch.Tensor) and ids is None and gpu_index is not None:
+            queries = query_embeddings.reshape(-1, self.dimension).float().contiguous()
+            if self.metric == "ip":
+                queries = torch.nn.functional.normalize(queries, dim=1)
+            # The id map's ids are the sub-index's positions (see add), so its labels need no mapping
+            distances, indices = gpu_index.search(queries, k)
+            distances, indices = distances.cpu().numpy(), indices.cpu().numpy()
+        else:
+            if isinstance(query_embeddings, torch.Tensor):
+                query_embeddings = query_embeddings.detach().float().cpu().numpy()
+            queries = self._prepare(query_embeddings.reshape(-1, self.dimension))
+            # Restored afterwards: the caller's thread may run torch or other OpenMP work next
+            threads = faiss.omp_get_max_threads()
+            faiss.omp_set_num_threads(1 if len(queries) == 1 else self.search_threads)
+            try:
+                if ids is None:
+                    distances, indices = self.index.search(queries, k)
+                else:
+                    distances, indices = self._search_filtered(queries, k, np.asarray(ids, dtype=np.int64))
+            finally:
+                faiss.omp_set_num_threads(threads)
+        
+        # IVF indexes pad with -1 when fewer than k neighbours are found
+        results = [self.metadata_rows([idx for idx in row if 0 <= idx < len(self.metadata)]) for row in indices]
+        return distances, results
+    
+    def _gpu_index(self):
+        """The GPU index that takes device tensors (the one inside the id map), or None on the CPU."""
+        if not self.on_gpu:
+            return None
+        index = self.index
+        if isinstance(index, faiss.IndexIDMap2):
+            # The GPU cloner keeps the id map on the host and moves only the wrapped index
+            index = faiss.downcast_index(index.index)
+        return index if hasattr(index, "getDevice") else None
+    
+    def _search_filtered(self, queries: np.ndarray, k: int, ids: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Search only the vectors at positions ids; FAISS skips the others during the scan."""
+        index = self.index
+        if self.on_gpu:
+            # GPU indexes take no IDSelector: over-fetch (GPU k is capped at 2048) and filter
+            fetch = min(self.index.ntotal, 2048)
+            distances, indices = self.index.search(queries, fetch)
+            keep = np.isin(indices, ids)
+            if fetch == self.index.ntotal or keep.sum(axis=1).min() >= min(k, len(ids)):
+                order = np.argsort(~keep, axis=1, kind="stable")[:, :k]
+                indices = np.where(np.take_along_axis(keep, order, axis=1), np.take_along_axis(indices, order, axis=1), -1)
+                return np.take_along_axis(distances, order, axis=1), indices
+            # Too selective for the capped fetch: run the selector on a host copy instead
+            if self._host_copy is None:
+                self._host_copy = faiss.index_gpu_to_cpu(self.index)
+            index = self._host_copy
         
-        results = [self.metadata[idx] for idx in indices[0] if idx < len(self.metadata)]
-        return distances[0], results
+        selector = faiss.IDSelectorBatch(ids)
+        try:
+            ivf = faiss.extract_index_ivf(index)
+        except RuntimeError:
+            ivf = None
+        if ivf is not None:
+            # Search parameters replace the index's own, so carry nprobe over
+            params = faiss.SearchParametersIVF(sel=selector, nprobe=ivf.nprobe)
+        else:
+            params = faiss.SearchParameters(sel=selector)
+        # faiss.contrib.torch_utils replaces index.search with a version without params
+        search = getattr(index, "search_numpy", index.search)
+        return search(queries, k, params=params)
     
     def save(self, index_path: str, metadata_path: str):
         Path(index_path).parent.mkdir(parents=True, exist_ok=True)
         
-        faiss.write_index(self.index, index_path)
-        
-        with open(metadata_path, 'wb') as f:
-            pickle.dump(self.metadata, f)
+        # GPU indexes can't be serialized directly
+        cpu_index = faiss.index_gpu_to_cpu(self.index) if self.on_gpu else self.index
+        faiss.write_index(cpu_index, index_path)
+        save_metadata(self.metadata, metadata_path)
         
         print(f"Saved index: {index_path}")
     
-    def load(self, index_path: str, metadata_path: str):
-        self.index = faiss.read_index(index_path)
+    def load(self, index_path: str, metadata_path: str, mmap: bool = False):
+        # On-disk inverted lists are looked up next to the index file, wherever it was built
+        flags = faiss.IO_FLAG_ONDISK_SAME_DIR
+        # Those lists are always memory-mapped; IO_FLAG_MMAP maps the rest (and must not
+        # be combined with on-disk lists)
+        if mmap and not Path(index_path).with_suffix(".ivfdata").exists():
+            flags |= faiss.IO_FLAG_MMAP
+        self.index = faiss.read_index(index_path, flags)
+        self._host_copy = None
+        self.metadata = read_metadata(metadata_path)
         
-        with open(metadata_path, 'rb') as f:
-            self.metadata = pickle.load(f)
+        # Search the way the index was built (indexes from before cosine are L2)
+        self.dimension = self.index.d
+        self.metric = "ip" if self.index.metric_type == faiss.METRIC_INNER_PRODUCT else "l2"
         
         return self
@@ -0,0 +1,73 @@
+"""
+Parquet metadata storage for FAISS indexes
+Kept free of faiss/torch imports so metadata-only scripts (and their worker
+processes) don't pay for them.
+"""
+
+import orjson
+import pickle
+import pyarrow as pa
+import pyarrow.parquet as pq
+from pathlib import Path
+from typing import List, Union
+
+def save_metadata(metadata: Union[List[dict], pa.Table], metadata_path: str):
+    """Save metadata rows as ZSTD-compressed Parquet (or pickle for a legacy .pkl path).
+    
+    Nested values (hours, parking, ...) are stored as JSON strings: their keys vary per
+    row, which doesn't map onto a fixed Arrow struct. A pa.Table of flat columns is
+    written as-is.
+    """
+    Path(metadata_path).parent.mkdir(parents=True, exist_ok=True)
+    
+    if isinstance(metadata, pa.Table) and Path(metadata_path).suffix != ".pkl":
+        pq.write_table(metadata, metadata_path, compression="zstd")
+        return
+    if isinstance(metadata, pa.Table):
+        metadata = metadata.to_pylist()
+    
+    if Path(metadata_path).suffix == ".pkl":
+        with open(metadata_path, 'wb') as f:
+            pickle.dump(metadata, f)
+        return
+    
+    json_columns = sorted({
+        key for row in metadata for key, value in row.items()
+        if isinstance(value, (dict, list, tuple))
+    })
+    if json_columns:
+        metadata = [
+            {**row, **{key: orjson.dumps(row[key]).decode() for key in json_columns if row.get(key) is not None}}
+            for row in metadata
+        ]
+    
+    table = pa.Table.from_pylist(metadata)
+    table = table.replace_schema_metadata({"json_columns": ",".join(json_columns)})
+    pq.write_table(table, metadata_path, compression="zstd")
+
+def table_rows(table: pa.Table) -> List[dict]:
+    """Rows of a metadata table as dicts, with the JSON-encoded nested columns decoded."""
+    rows = table.to_pylist()
+    
+    json_columns = (table.schema.metadata or {}).get(b"json_columns", b"").decode()
+    for key in filter(None, json_columns.split(",")):
+        for row in rows:
+            if row[key] is not None:
+                row[key] = orjson.loads(row[key])
+    return rows
+
+def read_metadata(metadata_path: str) -> Union[List[dict], pa.Table]:
+    """Read metadata saved by save_metadata without building per-row objects.
+    
+    Returns the memory-mapped pa.Table (decode rows with table_rows), or the row list
+    of a legacy .pkl file.
+    """
+    if Path(metadata_path).suffix == ".pkl":
+        with open(metadata_path, 'rb') as f:
+            return pickle.load(f)
+    return pq.read_table(metadata_path, memory_map=True)
+
+def load_metadata(metadata_path: str) -> List[dict]:
+    """Load metadata rows saved by save_metadata."""
+    metadata = read_metadata(metadata_path)
+    return table_rows(metadata) if isinstance(metadata, pa.Table) else metadata
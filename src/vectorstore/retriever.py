@@ -1,6 +1,8 @@
 from pathlib import Path
-from typing import Optional
+from typing import List, Optional
 import os
+import threading
+import pyarrow.compute as pc
 from .faiss_index import FAISSIndex
 from ..embeddings.text_embedder import TextEmbedder
 from ..embeddings.image_embedder import ImageEmbedder
@@ -16,44 +18,131 @@ class MultimodalRetriever:
         else:
             self.index_dir = project_root / index_dir
         
-        self.text_embedder = TextEmbedder(verbose=verbose)
-        self.image_embedder = ImageEmbedder(verbose=verbose)
+        # Embedders load on first use, so a text-only caller never loads CLIP (and vice versa)
+        self.verbose = verbose
+        self._text_embedder = None
+        self._image_embedder = None
+        self._embedder_lock = threading.Lock()
         
         self.text_index = FAISSIndex(dimension=768)
         self.image_index = FAISSIndex(dimension=512)
+        
+        # Indices are loaded on first search, once per retriever however many tools share it
+        self._loaded = False
+        self._load_lock = threading.Lock()
+    
+    @property
+    def text_embedder(self) -> TextEmbedder:
+        if self._text_embedder is None:
+            with self._embedder_lock:
+                if self._text_embedder is None:
+                    self._text_embedder = TextEmbedder(verbose=self.verbose)
+        return self._text_embedder
+    
+    @property
+    def image_embedder(self) -> ImageEmbedder:
+        if self._image_embedder is None:
+            with self._embedder_lock:
+                if self._image_embedder is None:
+                    self._image_embedder = ImageEmbedder(verbose=self.verbose)
+        return self._image_embedder
+    
+    def _ensure_loaded(self):
+        if self._loaded:
+            return
+        with self._load_lock:
+            if not self._loaded:
+                self.load_indices()
     
-    def search_text(self, query: str, k: int = 10):
+    @staticmethod
+    def _filter_ids(index: FAISSIndex, where: Optional[pc.Expression]):
+        """Positions matching a metadata filter such as pc.field("price_range") <= 2 (None: all)."""
+        return None if where is None else index.ids_where(where)
+    
+    def search_text(self, query: str, k: int = 10, where: Optional[pc.Expression] = None):
+        self._ensure_loaded()
         embedding = self.text_embedder.embed(query)
-        distances, results = self.text_index.search(embedding, k)
+        distances, results = self.text_index.search(embedding, k, ids=self._filter_ids(self.text_index, where))
+        return results
+    
+    def search_text_batch(self, queries: List[str], k: int = 10,
+                          where: Optional[pc.Expression] = None) -> List[List[dict]]:
+        """Search several text queries with one encode call and one FAISS search."""
+        self._ensure_loaded()
+        embeddings = self.text_embedder.embed_batch(queries, show_progress=False)
+        distances, results = self.text_index.search_batch(embeddings, k, ids=self._filter_ids(self.text_index, where))
         return results
     
-    def search_image(self, image_path: str, k: int = 10):
-        embedding = self.image_embedder.embed(image_path)
-        distances, results = self.image_index.search(embedding, k)
+    @staticmethod
+    def _with_similarity(index: FAISSIndex, distances, results: List[dict]) -> List[dict]:
+        """Copies of the results with score and similarity added
         
-        # Add distance and similarity to each result
-        for i, result in enumerate(results):
-            if i < len(distances):
-                result['distance'] = float(distances[i])
-                result['similarity'] = float(1 / (1 + distances[i]))
+        score is FAISS's raw value: the cosine for inner-product indexes, the L2 distance
+        for older L2 indexes. similarity is higher-is-better for both (the cosine, or
+        1 / (1 + distance)); use it for ranking and display.
         
-        return results
+        Metadata dicts of an index built in this process are shared by every search
+        (and query of a batch), so they aren't annotated in place.
+        """
+        similarities = index.similarity(distances)
+        return [
+            {**result, 'score': float(distance), 'similarity': float(similarity)}
+            for result, distance, similarity in zip(results, distances, similarities)
+        ]
+    
+    def search_image(self, image_path: str, k: int = 10, where: Optional[pc.Expression] = None):
+        self._ensure_loaded()
+        # A GPU index takes the query straight from the model's device; the CPU index takes numpy
+        if self.image_index.on_gpu:
+            embedding = self.image_embedder.embed_tensor(image_path)
+        else:
+            embedding = self.image_embedder.embed(image_path)
+        distances, results = self.image_index.search(embedding, k, ids=self._filter_ids(self.image_index, where))
+        return self._with_similarity(self.image_index, distances, results)
+    
+    def search_image_batch(self, image_paths: List[str], k: int = 10,
+                           where: Optional[pc.Expression] = None) -> List[List[dict]]:
+        """Search several query images with one CLIP forward and one FAISS search.
+        
+        Images that can't be decoded get an empty result list.
+        """
+        self._ensure_loaded()
+        # Query batches are small: decode in-process rather than starting DataLoader workers
+        embeddings, valid_indices = self.image_embedder.embed_batch(
+            image_paths, batch_size=len(image_paths) or 1, return_indices=True, num_workers=0, show_progress=False
+        )
+        all_results = [[] for _ in image_paths]
+        if len(valid_indices) == 0:
+            return all_results
+        
+        distances, results = self.image_index.search_batch(embeddings, k, ids=self._filter_ids(self.image_index, where))
+        for idx, query_distances, query_results in zip(valid_indices, distances, results):
+            all_results[idx] = self._with_similarity(self.image_index, query_distances, query_results)
+        return all_results
     
     def save_indices(self):
         self.text_index.save(
             str(self.index_dir / "text_index.faiss"),
-            str(self.index_dir / "text_metadata.pkl")
+            str(self.index_dir / "text_metadata.parquet")
         )
         self.image_index.save(
             str(self.index_dir / "image_index.faiss"),
-            str(self.index_dir / "image_metadata.pkl")
+            str(self.index_dir / "image_metadata.parquet")
         )
     
+    def _metadata_path(self, name: str) -> str:
+        """Parquet metadata path, falling back to a legacy pickle from older builds."""
+        parquet_path = self.index_dir / f"{name}_metadata.parquet"
+        legacy_path = self.index_dir / f"{name}_metadata.pkl"
+        if not parquet_path.exists() and legacy_path.exists():
+            return str(legacy_path)
+        return str(parquet_path)
+    
     def load_indices(self):
         text_index_path = str(self.index_dir / "text_index.faiss")
-        text_metadata_path = str(self.index_dir / "text_metadata.pkl")
+        text_metadata_path = self._metadata_path("text")
         image_index_path = str(self.index_dir / "image_index.faiss")
-        image_metadata_path = str(self.index_dir / "image_metadata.pkl")
+        image_metadata_path = self._metadata_path("image")
         
         # Verify text index exists (required)
         if not Path(text_index_path).exists():
@@ -64,12 +153,18 @@ class MultimodalRetriever:
             )
         
         # Load text index (required)
-        self.text_index.load(text_index_path, text_metadata_path)
+        self.text_index.load(text_index_path, text_metadata_path, mmap=True)
         
         # Load image index (optional)
         if Path(image_index_path).exists():
-            self.image_index.load(image_index_path, image_metadata_path)
+            self.image_index.load(image_index_path, image_metadata_path, mmap=True)
+        
+        # Search on the GPU when FAISS has one (no-op otherwise); the embedders already run there
+        self.text_index.to_gpu()
+        if self.image_index.index is not None:
+            self.image_index.to_gpu()
         
+        self._loaded = True
         return self
 
 
@@ -6,6 +6,7 @@ Simulates a user request: "Find a cheap restaurant that serves this [image]"
 import os
 import sys
 from pathlib import Path
+import pyarrow.compute as pc
 
 # Suppress warnings
 os.environ['TRANSFORMERS_VERBOSITY'] = 'error'
@@ -38,35 +39,26 @@ def hybrid_search_demo():
     query_image = "data/sample_images/burger.png"
     query_image_path = str(project_root / query_image)
     
-    # 3. Step 1: Image Search (The "Visual Intent")
-    # We search for the food item first because that's the primary constraint
-    print(f"\n2. Executing Image Search (Intent: 'serves this food')...")
-    # Get more candidates (k=20) to allow for filtering
-    image_results = retriever.search_image(query_image_path, k=20)
+    # 3. Step 1: Attribute Filter (The "Text Constraint")
+    # "cheap" usually implies Price Range = 1 or 2; unknown prices are kept to be safe
+    print(f"\n2. Building Filter (Intent: '{query_text}')...")
+    metadata = retriever.image_index.metadata
+    if 'price_range' in getattr(metadata, 'column_names', []):
+        price = pc.field('price_range')
+        cheap = (price <= 2) | price.is_null()
+    else:
+        print("   Image metadata has no price_range column; searching all photos")
+        cheap = None
+
+    # 4. Step 2: Image Search (The "Visual Intent")
+    # FAISS only scores photos that pass the filter, so no over-fetching is needed
+    print(f"\n3. Executing Filtered Image Search (Intent: 'serves this food')...")
+    final_results = retriever.search_image(query_image_path, k=5, where=cheap)
     
-    print(f"   Found {len(image_results)} candidates based on visual similarity.")
+    print(f"   Found {len(final_results)} candidates based on visual similarity.")
     print("   Top 3 Visual Matches:")
-    for r in image_results[:3]:
+    for r in final_results[:3]:
         print(f"   - {r['name']} (Sim: {r['similarity']:.3f})")
-
-    # 4. Step 2: Attribute Filtering (The "Text Constraint")
-    # "cheap" usually implies Price Range = 1 or 2
-    print(f"\n3. Applying Text Constraints (Intent: '{query_text}')...")
-    
-    final_results = []
-    
-    for r in image_results:
-        # Check price range (if available) - assuming 'price_range' is in metadata
-        # (It was added in the recent update!)
-        price = r.get('price_range')
-        
-        # Logic: If price is low (1 or 2) OR not specified (keep them to be safe)
-        is_cheap = price is None or price <= 2
-        
-        if is_cheap:
-            final_results.append(r)
-        else:
-            print(f"   Filtered out '{r['name']}' (Price: {price})")
             
     # 5. Final Output
     print(f"\n4. Final Recommendations ({len(final_results)} matches):")
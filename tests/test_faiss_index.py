@@ -0,0 +1,117 @@
+"""
+Unit tests for FAISSIndex search threading, metadata filters, filtered search and id-mapped indexes
+"""
+
+import sys
+from pathlib import Path
+
+import faiss
+import numpy as np
+import pyarrow.compute as pc
+import torch
+
+# Add project root to path
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from src.vectorstore.faiss_index import FAISSIndex
+
+DIMENSION = 16
+
+
+def make_index(n: int = 200, index_type: str = "Flat"):
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((n, DIMENSION)).astype('float32')
+    metadata = [
+        {'id': str(i), 'price_range': [1, 2, 3, None][i % 4], 'hours': {'Monday': '9:0-17:0'}}
+        for i in range(n)
+    ]
+    index = FAISSIndex(DIMENSION, index_type=index_type)
+    index.add(vectors, metadata)
+    return index, vectors
+
+
+def test_search_restores_omp_threads():
+    index, vectors = make_index(20)
+    threads = faiss.omp_get_max_threads()
+    try:
+        faiss.omp_set_num_threads(3)
+        index.search(vectors[0], k=5)
+        assert faiss.omp_get_max_threads() == 3
+        index.search_batch(vectors[:4], k=5)
+        assert faiss.omp_get_max_threads() == 3
+    finally:
+        faiss.omp_set_num_threads(threads)
+
+
+def test_ids_where_on_rows_and_loaded_table(tmp_path):
+    index, _ = make_index(20)
+    cheap = (pc.field('price_range') <= 2) | pc.field('price_range').is_null()
+    expected = [i for i in range(20) if i % 4 != 2]
+    assert index.ids_where(cheap).tolist() == expected
+
+    index.save(str(tmp_path / "index.faiss"), str(tmp_path / "metadata.parquet"))
+    loaded = FAISSIndex(dimension=0).load(str(tmp_path / "index.faiss"), str(tmp_path / "metadata.parquet"))
+    assert loaded.ids_where(cheap).tolist() == expected
+    assert loaded.ids_where(pc.field('price_range') == 3).tolist() == [i for i in range(20) if i % 4 == 2]
+
+
+def test_filtered_search_matches_brute_force():
+    for index_type in ("Flat", "IVF4,Flat"):
+        index, vectors = make_index(index_type=index_type)
+        if index.ivf_index() is not None:
+            index.ivf_index().nprobe = 4  # every list: exact
+        ids = index.ids_where(pc.field('price_range') == 3)
+
+        queries = vectors[:3]
+        distances, results = index.search_batch(queries, k=5, ids=ids)
+
+        normalized = index._prepare(vectors)
+        for query, row_distances, rows in zip(index._prepare(queries), distances, results):
+            scores = normalized[ids] @ query
+            expected = ids[np.argsort(-scores)[:5]]
+            assert [int(row['id']) for row in rows] == expected.tolist()
+            assert np.allclose(row_distances, np.sort(scores)[::-1][:5], atol=1e-5)
+            assert all(row['price_range'] == 3 for row in rows)
+
+
+def test_filtered_search_with_no_allowed_ids():
+    index, vectors = make_index(20)
+    _, results = index.search(vectors[0], k=5, ids=np.array([], dtype=np.int64))
+    assert results == []
+
+
+def test_add_and_reconstruct_all_with_id_map():
+    for index_type in ("Flat", "IVF4,Flat"):
+        index, vectors = make_index(120, index_type=index_type)
+        more = np.random.default_rng(1).standard_normal((30, DIMENSION)).astype('float32')
+        index.add(more, [{'id': str(120 + i)} for i in range(30)])
+
+        assert isinstance(index.index, faiss.IndexIDMap2)
+        assert index.index.ntotal == 150
+        # Ids are the metadata row numbers, in insertion order
+        assert faiss.vector_to_array(index.index.id_map).tolist() == list(range(150))
+        assert np.allclose(index.reconstruct_all(), index._prepare(np.vstack([vectors, more])), atol=1e-6)
+
+
+def test_sub_index_labels_are_id_map_ids():
+    for index_type in ("Flat", "IVF4,Flat"):
+        index, vectors = make_index(index_type=index_type)
+        index.add(vectors[:30] + 1, [{'id': str(200 + i)} for i in range(30)])
+        queries = index._prepare(vectors[:5])
+
+        sub_index = faiss.downcast_index(index.index.index)
+        _, labels = sub_index.search_numpy(queries, 5)
+        _, ids = index.index.search_numpy(queries, 5)
+        assert np.array_equal(labels, ids)
+
+
+def test_tensor_search_on_device_index(monkeypatch):
+    # No GPU here: stand the CPU sub-index in for the device one search_batch unwraps
+    index, vectors = make_index(index_type="Flat")
+    expected_distances, expected = index.search_batch(vectors[:3], k=5)
+
+    monkeypatch.setattr(index, "_gpu_index", lambda: faiss.downcast_index(index.index.index))
+    distances, results = index.search_batch(torch.from_numpy(vectors[:3]), k=5)
+    assert results == expected
+    assert np.allclose(distances, expected_distances, atol=1e-6)
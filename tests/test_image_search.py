@@ -78,10 +78,8 @@ def test_image_search():
                 print(f"   Cuisine: {result.get('categories', 'N/A')}")
                 print(f"   Rating: {result.get('rating', 'N/A')} ⭐")
                 
-                # Calculate similarity from distance
-                if 'distance' in result:
-                    similarity = 1 / (1 + result['distance'])
-                    print(f"   Similarity: {similarity:.3f}")
+                if 'similarity' in result:
+                    print(f"   Similarity: {result['similarity']:.3f}")
                 print()
         
         except Exception as e:
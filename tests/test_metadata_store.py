@@ -0,0 +1,59 @@
+"""
+Unit tests for the Parquet metadata store (save_metadata / read_metadata / table_rows)
+"""
+
+import sys
+from pathlib import Path
+
+import pyarrow as pa
+
+# Add project root to path
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from src.vectorstore.metadata_store import save_metadata, read_metadata, load_metadata, table_rows
+
+ROWS = [
+    {'id': 'a', 'name': 'Pho Place', 'price_range': 1, 'hours': {'Monday': '9:0-21:0'}, 'tags': ['vietnamese']},
+    {'id': 'b', 'name': 'Burger Bar', 'price_range': None, 'hours': None, 'tags': []},
+    {'id': 'c', 'name': 'Sushi Spot', 'price_range': 3, 'hours': {'Friday': '11:0-23:0', 'Saturday': '12:0-23:0'}, 'tags': ['japanese', 'sushi']},
+]
+
+
+def test_parquet_round_trip_decodes_json_columns(tmp_path):
+    path = tmp_path / "metadata.parquet"
+    save_metadata(ROWS, str(path))
+
+    table = read_metadata(str(path))
+    assert isinstance(table, pa.Table)
+    # Nested columns are stored as JSON strings and listed in the schema metadata
+    assert table.schema.metadata[b"json_columns"] == b"hours,tags"
+    assert table.column('hours').type == pa.string()
+
+    assert table_rows(table) == ROWS
+    assert load_metadata(str(path)) == ROWS
+
+
+def test_table_rows_of_a_slice(tmp_path):
+    path = tmp_path / "metadata.parquet"
+    save_metadata(ROWS, str(path))
+
+    table = read_metadata(str(path))
+    assert table_rows(table.take(pa.array([2, 0]))) == [ROWS[2], ROWS[0]]
+
+
+def test_flat_table_is_written_as_is(tmp_path):
+    path = tmp_path / "image_metadata.parquet"
+    table = pa.Table.from_pydict({'photo_id': ['p1', 'p2'], 'rating': [4.5, 3.0]})
+    save_metadata(table, str(path))
+
+    assert read_metadata(str(path)).equals(table)
+    assert load_metadata(str(path)) == table.to_pylist()
+
+
+def test_legacy_pickle_fallback(tmp_path):
+    path = tmp_path / "metadata.pkl"
+    save_metadata(ROWS, str(path))
+
+    assert read_metadata(str(path)) == ROWS
+    assert load_metadata(str(path)) == ROWS
@@ -0,0 +1,51 @@
+"""
+Unit tests for the Yelp attribute parsers in scripts/metadata_utils.py
+"""
+
+import sys
+from pathlib import Path
+
+# Add project root to path
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from scripts.metadata_utils import _parse_parking, _parse_price, create_text_metadata, clear_metadata_caches
+
+
+def test_parse_price():
+    assert _parse_price('2') == 2
+    assert _parse_price(3) == 3
+    assert _parse_price(None) is None
+    assert _parse_price('None') is None
+    assert _parse_price('') is None
+    assert _parse_price({'level': 2}) is None
+
+
+def test_parse_parking_from_yelp_string():
+    value = "{'garage': False, 'street': True, 'validated': False, 'lot': False, 'valet': False}"
+    assert _parse_parking(value) == {'garage': False, 'street': True, 'validated': False, 'lot': False, 'valet': False}
+
+
+def test_parse_parking_strips_unicode_prefixes():
+    assert _parse_parking("{u'garage': True, u'street': False}") == {'garage': True, 'street': False}
+
+
+def test_parse_parking_passthrough_and_invalid():
+    parking = {'lot': True}
+    assert _parse_parking(parking) is parking
+    assert _parse_parking(None) is None
+    assert _parse_parking('None') is None
+    assert _parse_parking("{'garage': ") is None
+    assert _parse_parking("__import__('os')") is None
+    assert _parse_parking(5) is None
+
+
+def test_attributes_cache_follows_record_changes():
+    restaurant = {'business_id': 'b1', 'name': 'Diner', 'attributes': {'RestaurantsPriceRange2': '1'}}
+    assert create_text_metadata(restaurant)['price_range'] == 1
+
+    restaurant['attributes'] = {'RestaurantsPriceRange2': '3'}
+    assert create_text_metadata(restaurant)['price_range'] == 3
+
+    clear_metadata_caches()
+    assert create_text_metadata({'business_id': 'b2', 'name': 'Cafe'})['price_range'] is None